@@ -1,17 +1,47 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import re
 import json
 import os
 import logging
-from urllib.parse import urljoin, urlparse, parse_qs
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qs
 import time
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, Future, FIRST_COMPLETED
+from collections import OrderedDict, deque
+import threading
+import atexit
+import queue
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 import cloudscraper
 import base64
+import codecs
+import hashlib
+import bisect
+import contextvars
+import sys
+
+# VIDEO_SOURCE_PATTERN uses possessive quantifiers and atomic groups, and the
+# deadline handling relies on TimeoutError covering futures timeouts
+if sys.version_info < (3, 11):
+    raise RuntimeError("Python 3.11 or newer is required")
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    from selenium import webdriver
+    from selenium.common.exceptions import TimeoutException as PageLoadTimeout
+    from selenium.webdriver.chrome.service import Service as ChromeService
+except ImportError:
+    webdriver = None
+    PageLoadTimeout = TimeoutError  # BrowserPool still takes other driver factories
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -64,10 +94,1694 @@ MANIFEST = {
     "catalogs": []
 }
 
+# Instrumentation settings: latency histogram buckets (seconds) and the
+# query parameter / header that ask for a per-request trace
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+METRICS_COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32)
+TRACE_PARAM = 'trace'
+TRACE_HEADER = 'X-Trace'
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class Trace:
+    """Timeline of the stages one request went through"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, stage, started, elapsed, **detail):
+        event = dict(
+            stage=stage,
+            start_ms=round((started - self.started) * 1000, 1),
+            ms=round(elapsed * 1000, 1),
+            thread=threading.current_thread().name,
+            **detail
+        )
+        with self.lock:
+            self.events.append(event)
+
+    def report(self):
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event['start_ms'])
+        return {'total_ms': round((time.monotonic() - self.started) * 1000, 1), 'events': events}
+
+def trace_requested(param, header):
+    """Whether a request asked for its trace with ?trace=1 or an X-Trace: 1 header"""
+    return param in ('1', 'true') or header in ('1', 'true')
+
+def submit_traced(executor, fn, *args):
+    """executor.submit that carries the caller's trace into the worker thread"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in Prometheus text format"""
+
+    def __init__(self, prefix='vidfast'):
+        self.prefix = prefix
+        self.kinds = {}  # name -> (type, help, buckets)
+        self.values = {}  # (name, labels) -> value, or [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, help, buckets=None):
+        self.kinds[name] = (kind, help, buckets)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = self.kinds[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def stage(self, stage, **detail):
+        """Time a block into the stage latency histogram and the request trace"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, started, **detail)
+
+    def record_stage(self, stage, started, **detail):
+        """Record a stage that began at time.monotonic() value `started` and ends now"""
+        elapsed = time.monotonic() - started
+        self.observe('stage_seconds', elapsed, stage=stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(stage, started, elapsed, **detail)
+
+    def event(self, name, **detail):
+        """Note a point event (fallback, cache hit) in the request trace"""
+        trace = current_trace.get()
+        if trace is not None:
+            now = time.monotonic()
+            trace.add(name, now, 0.0, **detail)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (
+            (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in labels
+        )
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+    def render(self, samples=()):
+        """Prometheus exposition text, plus extra (name, labels, value) samples"""
+        with self.lock:
+            values = {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                      for key, value in self.values.items()}
+        
+        by_name = {}
+        for (name, labels), value in sorted(values.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, labels, value in samples:
+            by_name.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        
+        lines = []
+        for name in sorted(by_name):
+            kind, help, buckets = self.kinds[name]
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in by_name[name]:
+                if kind != 'histogram':
+                    lines.append(f"{full_name}{self.format_labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{self.format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{full_name}_sum{self.format_labels(labels)} {total}")
+                lines.append(f"{full_name}_count{self.format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('stage_seconds', 'histogram', 'Time spent per scrape stage.', METRICS_LATENCY_BUCKETS)
+metrics.describe('upstream_responses_total', 'counter', 'Upstream responses by request kind and status code.')
+metrics.describe('fallbacks_total', 'counter', 'Fallback paths taken, by kind.')
+metrics.describe('iframe_depth', 'histogram', 'Nesting depth of each iframe scraped.', METRICS_COUNT_BUCKETS)
+metrics.describe('iframe_fanout', 'histogram', 'Iframes followed per page.', METRICS_COUNT_BUCKETS)
+metrics.describe('cache_hits_total', 'counter', 'Cache hits by cache.')
+metrics.describe('cache_misses_total', 'counter', 'Cache misses by cache.')
+metrics.describe('cache_hit_ratio', 'gauge', 'Cache hits over lookups since start, by cache.')
+metrics.describe('coalesced_calls_total', 'counter', 'Stream requests that joined an in-flight scrape.')
+
+# Stream result cache settings (seconds / entries)
+STREAM_CACHE_TTL = int(os.environ.get('STREAM_CACHE_TTL', 1800))
+STREAM_CACHE_STALE_TTL = int(os.environ.get('STREAM_CACHE_STALE_TTL', 3600))
+STREAM_CACHE_NEGATIVE_TTL = int(os.environ.get('STREAM_CACHE_NEGATIVE_TTL', 120))
+STREAM_CACHE_MAX_ENTRIES = int(os.environ.get('STREAM_CACHE_MAX_ENTRIES', 2000))
+
+class StreamCache:
+    """Bounded TTL/LRU cache of resolved stream lists with stale-while-revalidate"""
+
+    def __init__(self, ttl=STREAM_CACHE_TTL, stale_ttl=STREAM_CACHE_STALE_TTL,
+                 negative_ttl=STREAM_CACHE_NEGATIVE_TTL, max_entries=STREAM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='stream-cache-refresh')
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'evictions': 0}
+
+    def is_negative(self, streams):
+        """Check if a result is only the Direct Link fallback"""
+        return not streams or (len(streams) == 1 and streams[0].get('title', '').endswith('Direct Link'))
+
+    def get(self, key):
+        """Return (streams, is_stale) for a cached key, or (None, False)"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None, False
+
+            streams, expires_at = entry
+            if now < expires_at:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return streams, False
+
+            if now < expires_at + self.stale_ttl:
+                self.entries.move_to_end(key)
+                self.stats['stale_hits'] += 1
+                return streams, True
+
+            del self.entries[key]
+            self.stats['misses'] += 1
+            return None, False
+
+    def is_fresh(self, key):
+        """Whether key has an unexpired entry, without touching stats or LRU order"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() < entry[1]
+
+    def set(self, key, streams):
+        """Store a result, using the shorter TTL for fallback-only results"""
+        ttl = self.negative_ttl if self.is_negative(streams) else self.ttl
+        with self.lock:
+            self.entries[key] = (streams, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def refresh(self, key, loader):
+        """Reload a key in the background unless a refresh is already running"""
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+            self.stats['refreshes'] += 1
+
+        def run():
+            try:
+                self.set(key, loader())
+            except Exception as e:
+                logger.error(f"Background refresh failed for {key}: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        self.executor.submit(run)
+
+    def get_or_load(self, key, loader):
+        """Serve from cache, refreshing stale entries in the background"""
+        streams, is_stale = self.get(key)
+        metrics.event('stream_cache', result='miss' if streams is None else 'stale' if is_stale else 'hit')
+        if streams is not None:
+            if is_stale:
+                self.refresh(key, loader)
+            return streams
+
+        streams = loader()
+        self.set(key, streams)
+        return streams
+
+    def info(self):
+        """Cache statistics for the health endpoint"""
+        with self.lock:
+            return dict(self.stats, size=len(self.entries), max_entries=self.max_entries)
+
+# Request coalescing settings
+COALESCE_TIMEOUT = float(os.environ.get('COALESCE_TIMEOUT', 60))
+COALESCE_MAX_WORKERS = int(os.environ.get('COALESCE_MAX_WORKERS', 32))
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight call"""
+
+    def __init__(self, timeout=COALESCE_TIMEOUT, max_workers=COALESCE_MAX_WORKERS):
+        self.timeout = timeout
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='single-flight')
+        self.stats = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key, fn, timeout=None):
+        """Run fn for key, or wait on the call already in flight for it.
+
+        The call runs on a worker thread so every caller, including the one
+        that started it, waits at most `timeout` seconds. A call that outlives
+        its waiters keeps running and stays joinable until it finishes.
+        Exceptions raised by fn are re-raised in every waiting caller.
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            future = self.calls.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                metrics.event('coalesced')
+            else:
+                future = Future()
+                self.calls[key] = future
+                submit_traced(self.executor, self._run, key, fn, future)
+
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            with self.lock:
+                self.stats['timeouts'] += 1
+            logger.warning(f"Timed out waiting for in-flight call {key}")
+            raise
+
+    def _run(self, key, fn, future):
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            with self.lock:
+                self.stats['errors'] += 1
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+    def info(self):
+        """Coalescing statistics for the health endpoint"""
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.calls))
+
+# Batch resolution settings: items per request, and items resolved at once
+# across all batch requests
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 200))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+
+def parse_batch_items(payload):
+    """Return [(type, id)] from a batch body, or raise ValueError.
+
+    The body is a list, or an object with an "items" list. Items are
+    {"type": ..., "id": ...} objects or "type/id" strings, with ids in the
+    same form as /stream/<type>/<id>.json.
+    """
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError('expected a non-empty list of items')
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {BATCH_MAX_ITEMS} items per batch")
+    parsed = []
+    for item in items:
+        if isinstance(item, str) and '/' in item:
+            parsed.append(tuple(item.split('/', 1)))
+        elif isinstance(item, dict) and isinstance(item.get('type'), str) and isinstance(item.get('id'), str):
+            parsed.append((item['type'], item['id']))
+        else:
+            raise ValueError(f"invalid item: {item!r}")
+    return parsed
+
+# Next-episode prefetch settings
+PREFETCH_EPISODES = int(os.environ.get('PREFETCH_EPISODES', 1))  # episodes ahead; 0 disables
+PREFETCH_QUEUE_SIZE = int(os.environ.get('PREFETCH_QUEUE_SIZE', 50))
+PREFETCH_CONCURRENCY = int(os.environ.get('PREFETCH_CONCURRENCY', 2))
+PREFETCH_BUSY_THRESHOLD = int(os.environ.get('PREFETCH_BUSY_THRESHOLD', 4))  # foreground scrapes
+PREFETCH_MAX_DEFER = float(os.environ.get('PREFETCH_MAX_DEFER', 30))  # seconds
+
+class EpisodePrefetcher:
+    """Low-priority background scrapes of the episodes after the one just served.
+
+    Keys wait in a bounded queue (new ones are dropped when it is full) and
+    PREFETCH_CONCURRENCY worker threads load them into the result cache.
+    A worker holds back while PREFETCH_BUSY_THRESHOLD or more foreground
+    scrapes are running and gives up on a key deferred for PREFETCH_MAX_DEFER.
+    """
+
+    def __init__(self, cache, load, episodes=PREFETCH_EPISODES, queue_size=PREFETCH_QUEUE_SIZE,
+                 concurrency=PREFETCH_CONCURRENCY):
+        self.cache = cache
+        self.load = load
+        self.episodes = episodes
+        self.concurrency = concurrency
+        # Callables returning in-flight scrape counts; prefetches are subtracted
+        self.load_signals = []
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = set()
+        self.active = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.stats = {'scheduled': 0, 'cached': 0, 'dropped': 0, 'deferred_out': 0,
+                      'completed': 0, 'failed': 0}
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.concurrency:
+                thread = threading.Thread(target=self.run, name=f"prefetch-{len(self.threads)}", daemon=True)
+                self.threads.append(thread)
+                thread.start()
+
+    def schedule(self, series_id, season, episode):
+        """Queue the episodes after season:episode that are not cached yet"""
+        if self.episodes <= 0 or not str(episode).isdigit():
+            return
+        self.start()
+        for ahead in range(1, self.episodes + 1):
+            key = ('series', series_id, season, str(int(episode) + ahead))
+            with self.lock:
+                if key in self.pending:
+                    continue
+                if self.cache.is_fresh(key):
+                    self.stats['cached'] += 1
+                    continue
+                try:
+                    self.queue.put_nowait(key)
+                except queue.Full:
+                    self.stats['dropped'] += 1
+                    continue
+                self.pending.add(key)
+                self.stats['scheduled'] += 1
+
+    def foreground(self):
+        with self.lock:
+            active = self.active
+        return max(0, sum(signal() for signal in self.load_signals) - active)
+
+    def run(self):
+        while True:
+            key = self.queue.get()
+            try:
+                # Low priority: wait for foreground scrapes to drain first
+                deferred_until = time.monotonic() + PREFETCH_MAX_DEFER
+                while self.foreground() >= PREFETCH_BUSY_THRESHOLD and time.monotonic() < deferred_until:
+                    time.sleep(0.5)
+                if self.foreground() >= PREFETCH_BUSY_THRESHOLD:
+                    with self.lock:
+                        self.stats['deferred_out'] += 1
+                    continue
+                if self.cache.is_fresh(key):
+                    with self.lock:
+                        self.stats['cached'] += 1
+                    continue
+                
+                with self.lock:
+                    self.active += 1
+                try:
+                    logger.info(f"Prefetching {key}")
+                    self.load(key)
+                    with self.lock:
+                        self.stats['completed'] += 1
+                finally:
+                    with self.lock:
+                        self.active -= 1
+            except Exception as e:
+                with self.lock:
+                    self.stats['failed'] += 1
+                logger.warning(f"Prefetch failed for {key}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, queued=self.queue.qsize(), active=self.active, episodes_ahead=self.episodes)
+
+# Combined source pattern, equivalent to running the former per-pattern
+# findall passes (video/source tags, JS config keys, HLS/DASH/MP4 URLs,
+# atob payloads, playlist/manifest keys) in a single scan. Every match starts
+# with one of a small set of characters, so the pattern leads with that set
+# and lets the regex engine skip everything else quickly; each branch then
+# checks its own first character with a lookbehind. Tag matches only consume
+# the tag name so their attributes are still scanned as quoted URLs, and
+# quoted strings are validated with a lookahead and then taken whole, so each
+# one is walked once instead of once per extension.
+VIDEO_SOURCE_PATTERN = re.compile(
+    r'[<"\'aAmMpPsSfFvVuUlL](?:'
+    r'(?<=<)(?i:video|source)(?=[^>]*(?i:src)=["\'](?P<tag>[^"\']+)["\'])'
+    r'|(?<=[aA])(?i:tob)\s*\(\s*["\'](?P<atob>[^"\']+)["\']'
+    r'|(?:(?<=[pP])(?i:laylist)|(?<=[mM])(?i:anifest))\s*:\s*["\'](?P<config>[^"\']+)["\']'
+    r'|(?:(?<=[sS])(?i:rc)|(?<=[fF])(?i:ile)|(?<=[vV])(?i:ideo)|(?<=[uU])(?i:rl)|(?<=[lL])(?i:ink))\s*:\s*["\']'
+    r'(?=[^"\']+\.(?i:m3u8|mp4|webm|avi|mkv|mov|flv|ts)["\'])(?P<config_media>[^"\']++)["\']'
+    r'|(?<=["\'])'
+    r'(?=[^"\']+\.(?i:m3u8|mpd|mp4|webm|avi|mkv)[?"\']'
+    r'|(?=[^"\']*\.(?i:ts)[?"\'])(?>[^"\']*?(?i:stream|video|play|embed|player))[^"\']*\.(?i:ts)[?"\'])'
+    r'(?P<media>[^"\']++)["\']'
+    r')',
+    re.DOTALL
+)
+OBFUSCATED_SOURCE_PATTERN = re.compile(r'["\']([^"\']+\.(?:m3u8|mp4|webm|ts)(?:\?[^"\']*)?)["\']')
+
+NON_VIDEO_MARKERS = ('font', 'css', 'js', 'json', 'xml', 'txt', 'png', 'jpg', 'jpeg', 'gif', 'svg', 'ico')
+VIDEO_EXTENSIONS = ('.m3u8', '.mp4', '.webm', '.avi', '.mkv', '.mov', '.flv', '.ts', '.mpd')
+STREAMING_INDICATORS = ('stream', 'video', 'play', 'embed', 'player', 'watch', 'media')
+STREAMING_FORMAT_MARKERS = ('hls', 'dash', 'manifest', 'playlist')
+
+# HTML parser for the iframe/script pass: 'lxml' (targeted, falls back to
+# BeautifulSoup on failure) or 'html.parser' (BeautifulSoup only)
+HTML_PARSER = os.environ.get('HTML_PARSER', 'lxml')
+
+class PageElementsTarget:
+    """lxml parser target that only keeps iframe sources and inline script text"""
+
+    def __init__(self):
+        self.iframe_srcs = []
+        self.scripts = []
+        self.script_parts = None
+
+    def start(self, tag, attrib):
+        if tag == 'iframe':
+            self.iframe_srcs.append(attrib.get('src') or attrib.get('data-src'))
+        elif tag == 'script':
+            self.script_parts = []
+
+    def end(self, tag):
+        if tag == 'script' and self.script_parts is not None:
+            text = ''.join(self.script_parts)
+            if text:
+                self.scripts.append(text)
+            self.script_parts = None
+
+    def data(self, data):
+        if self.script_parts is not None:
+            self.script_parts.append(data)
+
+    def close(self):
+        return self.iframe_srcs, self.scripts
+
+# Overall time budget for a single stream request (seconds)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 25))
+MIN_FETCH_TIMEOUT = float(os.environ.get('MIN_FETCH_TIMEOUT', 1))
+
+class Deadline:
+    """Time budget carried through one scrape, with the sources found so far"""
+
+    def __init__(self, seconds=REQUEST_DEADLINE):
+        self.expires_at = time.monotonic() + seconds
+        self.partial_sources = []
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap):
+        """Shrink a stage timeout to fit the remaining budget"""
+        return min(cap, self.remaining())
+
+    def record(self, sources):
+        """Remember sources found so far in case the budget runs out"""
+        with self.lock:
+            for source in sources:
+                if source not in self.partial_sources:
+                    self.partial_sources.append(source)
+
+    def best_sources(self):
+        with self.lock:
+            return list(self.partial_sources)
+
+# Iframe crawl settings
+IFRAME_MAX_DEPTH = int(os.environ.get('IFRAME_MAX_DEPTH', 3))
+IFRAME_CONCURRENCY = int(os.environ.get('IFRAME_CONCURRENCY', 4))  # per page, 1 = sequential
+IFRAME_WORKERS = int(os.environ.get('IFRAME_WORKERS', 32))  # shared by all requests
+IFRAME_ENOUGH_SOURCES = int(os.environ.get('IFRAME_ENOUGH_SOURCES', 5))
+IFRAME_ENOUGH_MIN_SCORE = int(os.environ.get('IFRAME_ENOUGH_MIN_SCORE', 5))
+IFRAME_STOP_GRACE = float(os.environ.get('IFRAME_STOP_GRACE', 0.25))  # wait on running iframes after an early stop
+
+class SharedPool:
+    """Process-wide bounded executor that only takes a task when a worker is free to start it"""
+
+    def __init__(self, max_workers, name):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'inline': 0}
+
+    def submit(self, fn, *args):
+        """Start fn on a free worker and return its future, or return None if none is free"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.stats['inline'] += 1
+            return None
+        with self.lock:
+            self.stats['submitted'] += 1
+        future = submit_traced(self.executor, fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, max_workers=self.max_workers)
+
+class IframeCrawl:
+    """Per-request iframe crawl state: visited set, depth limit and early stop"""
+
+    def __init__(self, max_depth=IFRAME_MAX_DEPTH, enough_sources=IFRAME_ENOUGH_SOURCES,
+                 min_score=IFRAME_ENOUGH_MIN_SCORE, stop_grace=IFRAME_STOP_GRACE):
+        self.max_depth = max_depth
+        self.enough_sources = enough_sources
+        self.min_score = min_score
+        self.stop_grace = stop_grace
+        self.grace_until = None
+        self.visited = set()
+        self.good_sources = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(url):
+        """Normalize a URL for dedup: lowercase host, no fragment or default port"""
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower() or 'https'
+        netloc = parsed.netloc.lower()
+        if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+            netloc = netloc.rsplit(':', 1)[0]
+        return urlunparse((scheme, netloc, parsed.path or '/', parsed.params, parsed.query, ''))
+
+    def claim(self, url):
+        """Mark a URL as visited, returning False if it already was"""
+        key = self.normalize(url)
+        with self.lock:
+            if key in self.visited:
+                return False
+            self.visited.add(key)
+            return True
+
+    def record(self, sources, score):
+        """Count sources that rank high enough towards the early stop"""
+        with self.lock:
+            for source in sources:
+                if score(source) >= self.min_score:
+                    self.good_sources.add(source)
+
+    def enough(self):
+        with self.lock:
+            return len(self.good_sources) >= self.enough_sources
+
+    def wait_timeout(self, deadline):
+        """Seconds to keep waiting on running iframes: up to the deadline, or stop_grace once there are enough"""
+        timeout = deadline.remaining() if deadline else None
+        if self.enough():
+            with self.lock:
+                if self.grace_until is None:
+                    self.grace_until = time.monotonic() + self.stop_grace
+                grace = max(0.0, self.grace_until - time.monotonic())
+            timeout = grace if timeout is None else min(timeout, grace)
+        return timeout
+
+# Per-host rate limit settings: each host starts at RATE_LIMIT_RATE
+# requests/second, gains RATE_LIMIT_INCREASE per successful response up to
+# RATE_LIMIT_MAX_RATE and is cut by RATE_LIMIT_DECREASE on every 429/503
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 20))
+RATE_LIMIT_MIN_RATE = float(os.environ.get('RATE_LIMIT_MIN_RATE', 0.5))
+RATE_LIMIT_MAX_RATE = float(os.environ.get('RATE_LIMIT_MAX_RATE', 200))
+RATE_LIMIT_INCREASE = float(os.environ.get('RATE_LIMIT_INCREASE', 0.5))
+RATE_LIMIT_DECREASE = float(os.environ.get('RATE_LIMIT_DECREASE', 0.5))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 20))
+RATE_LIMIT_MAX_BACKOFF = float(os.environ.get('RATE_LIMIT_MAX_BACKOFF', 60))
+
+class HostRateLimiter:
+    """Shared per-host token bucket with Retry-After and 429/503-aware backoff.
+
+    The refill rate adapts per host (additive increase, multiplicative
+    decrease), so throughput climbs while a host keeps answering and drops
+    as soon as it pushes back.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST, max_backoff=RATE_LIMIT_MAX_BACKOFF,
+                 min_rate=RATE_LIMIT_MIN_RATE, max_rate=RATE_LIMIT_MAX_RATE,
+                 increase=RATE_LIMIT_INCREASE, decrease=RATE_LIMIT_DECREASE):
+        self.rate = rate
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _host(self, url):
+        netloc = urlparse(url).netloc.lower()
+        state = self.hosts.get(netloc)
+        if state is None:
+            state = self.hosts[netloc] = {
+                'tokens': self.burst, 'updated': time.monotonic(), 'rate': self.rate,
+                'backoff': 0.0, 'blocked_until': 0.0, 'throttled': 0
+            }
+        return state
+
+    def acquire(self, url, timeout=None):
+        """Wait for a request slot on the URL's host.
+
+        Returns False without waiting if the slot would not come up within
+        `timeout` seconds.
+        """
+        wait = self.reserve(url, timeout)
+        if wait is None:
+            return False
+        
+        if wait > 0:
+            with metrics.stage('rate_limit_wait', host=urlparse(url).netloc):
+                time.sleep(wait)
+        return True
+
+    def reserve(self, url, timeout=None):
+        """Reserve a request slot and return how long to wait for it.
+
+        Returns None, reserving nothing, if the wait would exceed `timeout`.
+        Async callers use this directly and wait without blocking a thread.
+        """
+        with self.lock:
+            state = self._host(url)
+            now = time.monotonic()
+            state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated']) * state['rate'])
+            state['updated'] = now
+            
+            # Reserve a token now; a negative balance is the queue ahead of us
+            state['tokens'] -= 1
+            wait = max(0.0, -state['tokens'] / state['rate'], state['blocked_until'] - now)
+            if timeout is not None and wait > timeout:
+                state['tokens'] += 1
+                return None
+        
+        return wait
+
+    def on_response(self, url, status_code, retry_after=None):
+        """Back off and slow down a host that pushes back, and speed up again once it recovers"""
+        with self.lock:
+            state = self._host(url)
+            if status_code in (429, 503):
+                self._set_rate(state, state['rate'] * self.decrease)
+                state['backoff'] = min(self.max_backoff, max(1.0, state['backoff'] * 2))
+                delay = self.parse_retry_after(retry_after)
+                if delay is None:
+                    delay = state['backoff']
+                state['blocked_until'] = max(state['blocked_until'], time.monotonic() + min(delay, self.max_backoff))
+                state['throttled'] += 1
+                logger.warning(f"Host {urlparse(url).netloc} returned {status_code}, backing off {delay:.1f}s")
+            elif status_code < 400:
+                self._set_rate(state, state['rate'] + self.increase)
+                state['backoff'] = state['backoff'] / 2 if state['backoff'] >= 2 else 0.0
+
+    def _set_rate(self, state, rate):
+        """Change a host's refill rate, settling the tokens earned at the old rate first"""
+        now = time.monotonic()
+        state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated']) * state['rate'])
+        state['updated'] = now
+        state['rate'] = min(self.max_rate, max(self.min_rate, rate))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Parse a Retry-After header given in seconds or as an HTTP date"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def info(self):
+        """Per-host limiter state for the health endpoint"""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                netloc: {
+                    'rate': round(state['rate'], 2),
+                    'backoff': state['backoff'],
+                    'blocked_for': round(max(0.0, state['blocked_until'] - now), 2),
+                    'throttled': state['throttled']
+                }
+                for netloc, state in self.hosts.items()
+            }
+
+# URL template preference index settings
+TEMPLATE_INDEX_PATH = os.environ.get('TEMPLATE_INDEX_PATH', 'template_index.json')
+TEMPLATE_INDEX_SAVE_INTERVAL = float(os.environ.get('TEMPLATE_INDEX_SAVE_INTERVAL', 30))
+TEMPLATE_EXPLORE_RATE = float(os.environ.get('TEMPLATE_EXPLORE_RATE', 0.05))
+TEMPLATE_CONFIDENT_RATE = float(os.environ.get('TEMPLATE_CONFIDENT_RATE', 0.8))
+TEMPLATE_CONFIDENT_TRIES = int(os.environ.get('TEMPLATE_CONFIDENT_TRIES', 5))
+
+class TemplateIndex:
+    """Learned hit rate and latency per (base URL, content type, URL template).
+
+    Hit rates are exponentially weighted so a template that stops working
+    loses its place after a few failures. The index is persisted to a JSON
+    file so the preference survives restarts.
+    """
+
+    def __init__(self, path=TEMPLATE_INDEX_PATH, alpha=0.2):
+        self.path = path
+        self.alpha = alpha
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_saved = 0.0
+        self.load()
+        atexit.register(self.save, force=True)
+
+    def key(self, base_url, content_type, template):
+        return f"{base_url}|{content_type}|{template}"
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.stats = json.load(f)
+            logger.info(f"Loaded {len(self.stats)} URL template stats from {self.path}")
+        except Exception as e:
+            logger.warning(f"Failed to load URL template index {self.path}: {e}")
+
+    def save(self, force=False):
+        """Write the index to disk, at most once per save interval unless forced"""
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            if not force and time.time() - self.last_saved < TEMPLATE_INDEX_SAVE_INTERVAL:
+                return
+            snapshot = json.dumps(self.stats)
+            self.dirty = False
+            self.last_saved = time.time()
+        
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to save URL template index {self.path}: {e}")
+
+    def record(self, base_url, content_type, template, hit, latency):
+        """Record the outcome of fetching one template"""
+        with self.lock:
+            entry = self.stats.setdefault(
+                self.key(base_url, content_type, template),
+                {'hit_rate': 0.5, 'latency': latency, 'tries': 0}
+            )
+            entry['hit_rate'] += self.alpha * ((1.0 if hit else 0.0) - entry['hit_rate'])
+            entry['latency'] += self.alpha * (latency - entry['latency'])
+            entry['tries'] += 1
+            self.dirty = True
+        self.save()
+
+    def plan(self, base_url, content_type, templates):
+        """Return the templates to try as waves, most likely winner first.
+
+        A template with a confident hit rate gets a wave of its own so the
+        others are only fetched if it fails. Occasionally every template is
+        tried at once so a change in site layout gets noticed.
+        """
+        with self.lock:
+            entries = [self.stats.get(self.key(base_url, content_type, t)) for t in templates]
+        
+        def rank(i):
+            entry = entries[i]
+            if entry is None:
+                return (-0.5, 0.0, i)
+            return (-entry['hit_rate'], entry['latency'], i)
+        
+        order = sorted(range(len(templates)), key=rank)
+        ordered = [templates[i] for i in order]
+        
+        if random.random() < TEMPLATE_EXPLORE_RATE:
+            return [ordered]
+        
+        top = entries[order[0]]
+        if top and top['tries'] >= TEMPLATE_CONFIDENT_TRIES and top['hit_rate'] >= TEMPLATE_CONFIDENT_RATE:
+            return [ordered[:1], ordered[1:]]
+        return [ordered]
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats)
+
+# Mirror health monitoring settings
+MIRROR_MONITOR = os.environ.get('MIRROR_MONITOR', '1') == '1'  # 0 never probes; tests and benchmarks
+MIRROR_PROBE_INTERVAL = float(os.environ.get('MIRROR_PROBE_INTERVAL', 300))  # <= 0 probes once
+MIRROR_PROBE_TIMEOUT = float(os.environ.get('MIRROR_PROBE_TIMEOUT', 10))
+MIRROR_FAILOVER_THRESHOLD = int(os.environ.get('MIRROR_FAILOVER_THRESHOLD', 3))
+
+class MirrorMonitor:
+    """Background health and latency tracking for the mirror base URLs.
+
+    The first mirror is used until the first probe round finishes, so the
+    app can serve immediately. After that the current mirror is only
+    replaced, by the fastest healthy one, when it fails a probe or keeps
+    failing real fetches.
+    """
+
+    def __init__(self, base_urls, probe, interval=MIRROR_PROBE_INTERVAL,
+                 failover_threshold=MIRROR_FAILOVER_THRESHOLD):
+        self.base_urls = list(base_urls)
+        self.probe = probe
+        self.interval = interval
+        self.failover_threshold = failover_threshold
+        self.current = self.base_urls[0]
+        self.probed = False
+        self.status = {
+            url: {'healthy': None, 'latency': None, 'last_checked': None,
+                  'consecutive_failures': 0, 'last_error': None}
+            for url in self.base_urls
+        }
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start probing in a daemon thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='mirror-monitor', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Mirror probe round failed: {e}")
+            if self.interval <= 0:
+                return
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def probe_all(self):
+        """Probe every mirror concurrently and fail over if needed"""
+        with ThreadPoolExecutor(max_workers=len(self.base_urls), thread_name_prefix='mirror-probe') as executor:
+            futures = {executor.submit(self.probe_one, url): url for url in self.base_urls}
+            for future in as_completed(futures):
+                future.result()
+        
+        with self.lock:
+            first_round = not self.probed
+            self.probed = True
+            if first_round or not self.status[self.current]['healthy']:
+                self._switch(exclude=None)
+
+    def probe_one(self, url):
+        started = time.monotonic()
+        try:
+            with metrics.stage('mirror_probe', mirror=url):
+                healthy = self.probe(url)
+            error = None if healthy else 'unhealthy response'
+        except Exception as e:
+            healthy, error = False, str(e)
+        latency = time.monotonic() - started
+        
+        with self.lock:
+            state = self.status[url]
+            state.update(healthy=healthy, latency=round(latency, 3) if healthy else None,
+                         last_checked=time.time(), last_error=error)
+            if healthy:
+                state['consecutive_failures'] = 0
+        logger.info(f"Mirror {url}: {'healthy' if healthy else 'unhealthy'} in {latency:.2f}s")
+
+    def _switch(self, exclude):
+        """Move to the fastest healthy mirror; caller holds the lock"""
+        candidates = [
+            url for url, state in self.status.items()
+            if state['healthy'] and url != exclude
+        ]
+        if not candidates:
+            logger.warning(f"No healthy mirror found, staying on {self.current}")
+            return
+        
+        best = min(candidates, key=lambda url: self.status[url]['latency'])
+        if best != self.current:
+            logger.warning(f"Switching mirror from {self.current} to {best}")
+            self.current = best
+
+    def mirror_for(self, url):
+        for base_url in self.base_urls:
+            if url == base_url or url.startswith(base_url + '/'):
+                return base_url
+        return None
+
+    def report(self, url, ok):
+        """Feed the outcome of a real fetch into the mirror's health"""
+        base_url = self.mirror_for(url)
+        if base_url is None:
+            return
+        
+        with self.lock:
+            state = self.status[base_url]
+            if ok:
+                state['consecutive_failures'] = 0
+                return
+            
+            state['consecutive_failures'] += 1
+            if state['consecutive_failures'] < self.failover_threshold or base_url != self.current:
+                return
+            
+            state['healthy'] = False
+            self._switch(exclude=base_url)
+        
+        # Re-check every mirror soon instead of waiting for the next round
+        self.wakeup.set()
+
+    def info(self):
+        """Per-mirror status for the health endpoint"""
+        with self.lock:
+            return {
+                'current': self.current,
+                'probed': self.probed,
+                'mirrors': {url: dict(state) for url, state in self.status.items()}
+            }
+
+# Session pool and Cloudflare clearance settings
+SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', 8))
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))  # hosts kept alive per session
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))  # connections per host
+CLEARANCE_STORE_PATH = os.environ.get('CLEARANCE_STORE_PATH', 'cf_clearance.json')
+CLEARANCE_DEFAULT_TTL = float(os.environ.get('CLEARANCE_DEFAULT_TTL', 1800))
+CLEARANCE_COOKIES = ('cf_clearance', '__cf_bm')
+
+class SessionPool:
+    """Bounded pool of HTTP sessions; each borrower gets a session to itself"""
+
+    def __init__(self, factory, size=SESSION_POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self, timeout=None):
+        """Borrow a session, waiting up to `timeout` seconds if all are in use"""
+        session = self._acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.idle.put(session)
+
+    def _acquire(self, timeout):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        try:
+            return self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No session available within {timeout}s") from None
+
+    def info(self):
+        return {'size': self.size, 'created': self.created, 'idle': self.idle.qsize()}
+
+def mount_http_adapters(session):
+    """Give a session keep-alive connection pools sized from the settings"""
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class ClearanceStore:
+    """Cloudflare clearance cookies shared by all sessions and persisted to disk.
+
+    Clearance is tied to the User-Agent that solved the challenge, so that is
+    stored with the cookies and sent along with them. A per-host lock lets one
+    worker solve a challenge while the others wait and then reuse the result.
+    """
+
+    def __init__(self, path=CLEARANCE_STORE_PATH):
+        self.path = path
+        self.entries = {}
+        self.no_challenge = set()
+        self.solve_locks = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+            logger.info(f"Loaded Cloudflare clearance for {len(self.entries)} hosts from {self.path}")
+        except Exception as e:
+            logger.warning(f"Failed to load clearance store {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            snapshot = json.dumps(self.entries)
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to save clearance store {self.path}: {e}")
+
+    def get(self, host):
+        """Return the unexpired clearance entry for a host, if any"""
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry and entry['expires'] <= time.time():
+                del self.entries[host]
+                entry = None
+            return entry
+
+    def needs_solve(self, host):
+        return host not in self.no_challenge and self.get(host) is None
+
+    def solve_lock(self, host):
+        with self.lock:
+            return self.solve_locks.setdefault(host, threading.Lock())
+
+    def harvest(self, host, session, response):
+        """Store clearance cookies a session picked up while fetching from host"""
+        cookies = {}
+        expires = time.time() + CLEARANCE_DEFAULT_TTL
+        hostname = host.split(':')[0]
+        for cookie in session.cookies:
+            if cookie.name in CLEARANCE_COOKIES and hostname.endswith(cookie.domain.lstrip('.')):
+                cookies[cookie.name] = cookie.value
+                if cookie.expires:
+                    expires = min(expires, cookie.expires)
+        
+        if 'cf_clearance' not in cookies:
+            # A clean response without any stored clearance means no challenge here
+            if response.status_code < 400 and self.get(host) is None:
+                with self.lock:
+                    self.no_challenge.add(host)
+            return
+        
+        entry = {
+            'cookies': cookies,
+            'user_agent': response.request.headers.get('User-Agent'),
+            'expires': expires
+        }
+        with self.lock:
+            changed = self.entries.get(host, {}).get('cookies') != cookies
+            self.entries[host] = entry
+            self.no_challenge.discard(host)
+        if changed:
+            logger.info(f"Stored Cloudflare clearance for {host}")
+            self.save()
+
+    def info(self):
+        with self.lock:
+            return {
+                'hosts': {host: round(entry['expires'] - time.time()) for host, entry in self.entries.items()},
+                'no_challenge': sorted(self.no_challenge)
+            }
+
+# Streaming read settings: pages are scanned as they download and the
+# connection is closed once enough good sources have been seen
+STREAM_EARLY_EXIT = os.environ.get('STREAM_EARLY_EXIT', '1') == '1'
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 16384))
+STREAM_SCAN_OVERLAP = int(os.environ.get('STREAM_SCAN_OVERLAP', 4096))
+STREAM_ENOUGH_SOURCES = int(os.environ.get('STREAM_ENOUGH_SOURCES', 5))
+
+class ScannedPage(str):
+    """Page text that carries the source matches found while it streamed in"""
+
+    source_matches = None
+
+class EarlyExitScanner:
+    """Decode a page body chunk by chunk and collect source matches as they appear.
+
+    Each chunk is scanned together with the unsettled end of the previous
+    window. A match is kept once it ends at least STREAM_SCAN_OVERLAP
+    characters before the end of the text read so far; later ones are
+    rescanned with the next chunk, so the collected matches are the ones a
+    single scan of the whole text finds, and extraction reuses them.
+    """
+
+    def __init__(self, scraper, encoding, enough=STREAM_ENOUGH_SOURCES,
+                 min_score=IFRAME_ENOUGH_MIN_SCORE, overlap=STREAM_SCAN_OVERLAP):
+        self.scraper = scraper
+        self.enough = enough
+        self.min_score = min_score
+        self.overlap = overlap
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.parts = []
+        self.unsettled = ''
+        self.matches = []  # distinct (kind, match) in document order
+        self.seen = set()
+        self.good_sources = set()
+        self.bytes_read = 0
+
+    def feed(self, chunk):
+        """Add a chunk of bytes; returns True once enough good sources were seen"""
+        self.bytes_read += len(chunk)
+        text = self.decoder.decode(chunk)
+        self.parts.append(text)
+        window = self.unsettled + text
+        self.scan(window, len(window) - self.overlap)
+        return len(self.good_sources) >= self.enough
+
+    def scan(self, window, settled):
+        """Keep the matches ending by `settled` and hold back the text after the last of them"""
+        resume = None
+        for m in VIDEO_SOURCE_PATTERN.finditer(window):
+            kind = m.lastgroup
+            # Tag matches capture their src in a lookahead past the match itself
+            if max(m.end(), m.end(kind) + 1) > settled:
+                resume = m.start()
+                break
+            resume = m.end()
+            match = m.group(kind)
+            if (kind, match) in self.seen:
+                continue
+            self.seen.add((kind, match))
+            self.matches.append((kind, match))
+            source = self.scraper.source_from_match(kind, match)
+            if source and self.scraper.get_quality_score(source) >= self.min_score:
+                self.good_sources.add(source)
+        else:
+            resume = max(resume or 0, settled)
+        self.unsettled = window[resume:]
+
+    def text(self):
+        """The text read so far, with the matches of a full scan over it"""
+        tail = self.decoder.decode(b'', final=True)
+        window = self.unsettled + tail
+        self.scan(window, len(window))
+        page = ScannedPage(''.join(self.parts) + tail)
+        page.source_matches = self.matches
+        return page
+
+# Script deobfuscation memo settings
+SCRIPT_MEMO_MAX_BYTES = int(os.environ.get('SCRIPT_MEMO_MAX_BYTES', 4 * 1024 * 1024))
+SCRIPT_MEMO_MAX_SCRIPT_SIZE = int(os.environ.get('SCRIPT_MEMO_MAX_SCRIPT_SIZE', 2 * 1024 * 1024))  # characters
+SCRIPT_MEMO_ENTRY_OVERHEAD = 128  # bytes charged per entry for the key and bookkeeping
+
+class ScriptMemo:
+    """Bounded LRU memo of inline script content hash -> extracted sources.
+
+    Player bundles are often byte-for-byte identical across titles and
+    mirrors, so a repeat costs one hash instead of a decode and regex scan.
+    Entries are charged by the size of their results and evicted oldest first
+    once SCRIPT_MEMO_MAX_BYTES is exceeded; scripts over
+    SCRIPT_MEMO_MAX_SCRIPT_SIZE bypass the memo.
+    """
+
+    def __init__(self, max_bytes=SCRIPT_MEMO_MAX_BYTES, max_script_size=SCRIPT_MEMO_MAX_SCRIPT_SIZE):
+        self.max_bytes = max_bytes
+        self.max_script_size = max_script_size
+        self.entries = OrderedDict()  # key -> (sources, charged bytes)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0}
+
+    def extract(self, script, extractor):
+        """Return extractor(script), reusing the result for identical scripts"""
+        if len(script) > self.max_script_size:
+            with self.lock:
+                self.stats['bypassed'] += 1
+            return extractor(script)
+        
+        key = hashlib.blake2b(script.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return list(entry[0])
+            self.stats['misses'] += 1
+        
+        sources = tuple(extractor(script))
+        size = SCRIPT_MEMO_ENTRY_OVERHEAD + sum(len(source) for source in sources)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self.entries[key] = (sources, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats['evictions'] += 1
+        return list(sources)
+
+    def info(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, entries=len(self.entries), bytes=self.bytes,
+                        hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else None)
+
+# Source liveness verification settings
+VERIFY_SOURCES = os.environ.get('VERIFY_SOURCES', '0') == '1'
+VERIFY_BUDGET = float(os.environ.get('VERIFY_BUDGET', 2))  # seconds for the whole stage
+VERIFY_CONCURRENCY = int(os.environ.get('VERIFY_CONCURRENCY', 8))
+VERIFY_MAX_SOURCES = int(os.environ.get('VERIFY_MAX_SOURCES', 10))
+VERIFY_TTL = float(os.environ.get('VERIFY_TTL', 300))
+VERIFY_DEAD_TTL = float(os.environ.get('VERIFY_DEAD_TTL', 60))  # also used for unconfirmed sources
+VERIFY_MAX_ENTRIES = int(os.environ.get('VERIFY_MAX_ENTRIES', 4096))
+VERIFY_LATENCY_WEIGHT = float(os.environ.get('VERIFY_LATENCY_WEIGHT', 4))  # score points per second of TTFB
+
+class SourceVerifier:
+    """Per-URL TTL cache of source liveness probes and the ranking built on it.
+
+    A probe asks for the first byte only (GET with Range: bytes=0-0, which CDNs
+    answer more reliably than HEAD). Results are (alive, ttfb): alive is False
+    for connection errors, 404/410 and 5xx, None for other 4xx answers (often
+    referer or geo checks a real player would pass), and True otherwise.
+    """
+
+    def __init__(self, ttl=VERIFY_TTL, dead_ttl=VERIFY_DEAD_TTL, max_entries=VERIFY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.dead_ttl = dead_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # url -> (expires, alive, ttfb)
+        self.lock = threading.Lock()
+        self.stats = {'probes': 0, 'hits': 0, 'dead': 0, 'dropped': 0}
+
+    @staticmethod
+    def classify(status_code):
+        if status_code in (404, 410) or status_code >= 500:
+            return False
+        if status_code >= 400:
+            return None
+        return True
+
+    def get(self, url):
+        """Return a fresh (alive, ttfb) for url, or None if it needs probing"""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return entry[1], entry[2]
+
+    def set(self, url, alive, ttfb):
+        with self.lock:
+            self.stats['probes'] += 1
+            if alive is False:
+                self.stats['dead'] += 1
+            ttl = self.ttl if alive else self.dead_ttl
+            self.entries[url] = (time.time() + ttl, alive, ttfb)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pending(self, sources):
+        """The top sources without a fresh probe result"""
+        top = sources[:VERIFY_MAX_SOURCES]
+        pending = [url for url in top if self.get(url) is None]
+        with self.lock:
+            self.stats['hits'] += len(top) - len(pending)
+        return pending
+
+    def rank(self, sources, score):
+        """Drop sources known to be dead and order the rest by score minus a TTFB penalty.
+
+        Sources that could not be confirmed within the budget are charged the
+        whole budget, so they stay behind live sources of similar quality.
+        """
+        ranked = []
+        for url in sources:
+            result = self.get(url)
+            if result is not None and result[0] is False:
+                with self.lock:
+                    self.stats['dropped'] += 1
+                logger.info(f"Dropping dead source: {url}")
+                continue
+            ttfb = result[1] if result is not None and result[0] else VERIFY_BUDGET
+            ranked.append((score(url) - ttfb * VERIFY_LATENCY_WEIGHT, url))
+        
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [url for _, url in ranked]
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, enabled=VERIFY_SOURCES, entries=len(self.entries))
+
+# HLS master playlist introspection settings
+HLS_INSPECT = os.environ.get('HLS_INSPECT', '1') == '1'
+HLS_INSPECT_BUDGET = float(os.environ.get('HLS_INSPECT_BUDGET', 2))  # seconds for the whole stage
+HLS_INSPECT_CONCURRENCY = int(os.environ.get('HLS_INSPECT_CONCURRENCY', 5))
+HLS_INSPECT_MAX = int(os.environ.get('HLS_INSPECT_MAX', 5))  # playlists fetched per scrape
+HLS_MANIFEST_TTL = float(os.environ.get('HLS_MANIFEST_TTL', 600))
+HLS_MANIFEST_FAILURE_TTL = float(os.environ.get('HLS_MANIFEST_FAILURE_TTL', 60))
+HLS_MANIFEST_MAX_ENTRIES = int(os.environ.get('HLS_MANIFEST_MAX_ENTRIES', 2048))
+HLS_MAX_PLAYLIST_BYTES = int(os.environ.get('HLS_MAX_PLAYLIST_BYTES', 256 * 1024))
+
+# Minimum variant height -> score on the get_quality_score scale. Inspected
+# masters are scored from HLS_INSPECTED_SCORE up, above every URL-based guess
+HLS_HEIGHT_SCORES = ((2160, 10), (1440, 8), (1080, 6), (720, 4), (480, 2), (360, 1))
+HLS_INSPECTED_SCORE = 8
+HLS_FAILED_SCORE = 0
+HLS_CODEC_NAMES = (('hvc1', 'HEVC'), ('hev1', 'HEVC'), ('av01', 'AV1'), ('avc1', 'H.264'), ('avc3', 'H.264'), ('vp09', 'VP9'))
+
+HLS_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+def parse_master_playlist(text):
+    """Return the EXT-X-STREAM-INF variants of an HLS playlist (empty for media playlists)"""
+    variants = []
+    for line in text.splitlines():
+        if not line.startswith('#EXT-X-STREAM-INF:'):
+            continue
+        
+        attributes = {key: value.strip('"') for key, value in HLS_ATTRIBUTE_PATTERN.findall(line[18:])}
+        width, _, height = attributes.get('RESOLUTION', '').partition('x')
+        bandwidth = attributes.get('AVERAGE-BANDWIDTH') or attributes.get('BANDWIDTH') or ''
+        variants.append({
+            'width': int(width) if width.isdigit() else 0,
+            'height': int(height) if height.isdigit() else 0,
+            'bandwidth': int(bandwidth) if bandwidth.isdigit() else 0,
+            'codecs': attributes.get('CODECS', '')
+        })
+    return variants
+
+# Cached in place of the variants when a playlist could not be fetched
+PLAYLIST_FAILED = object()
+
+def best_variant(variants):
+    """The highest resolution (then bitrate) variant that states a resolution, if any"""
+    if variants is PLAYLIST_FAILED:
+        return None
+    variants = [variant for variant in variants or () if variant['height']]
+    if not variants:
+        return None
+    return max(variants, key=lambda variant: (variant['height'], variant['bandwidth']))
+
+class ManifestCache:
+    """Per-URL TTL cache of parsed HLS master playlist variants.
+
+    Media (non-master) playlists are cached as an empty variant list and
+    failed fetches as PLAYLIST_FAILED, for the shorter HLS_MANIFEST_FAILURE_TTL.
+    """
+
+    def __init__(self, ttl=HLS_MANIFEST_TTL, failure_ttl=HLS_MANIFEST_FAILURE_TTL,
+                 max_entries=HLS_MANIFEST_MAX_ENTRIES):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # url -> (expires, variants or PLAYLIST_FAILED)
+        self.lock = threading.Lock()
+        self.stats = {'fetches': 0, 'failures': 0, 'masters': 0, 'hits': 0}
+
+    def get(self, url):
+        """Return the cached variants or PLAYLIST_FAILED for url, or None if it has not been fetched"""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return entry[1]
+
+    def set(self, url, variants):
+        """Cache a fetch result; variants is None when the fetch failed"""
+        with self.lock:
+            self.stats['fetches'] += 1
+            if variants is None:
+                self.stats['failures'] += 1
+            elif variants:
+                self.stats['masters'] += 1
+            ttl = self.failure_ttl if variants is None else self.ttl
+            self.entries[url] = (time.time() + ttl, PLAYLIST_FAILED if variants is None else tuple(variants))
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pending(self, sources):
+        """The top HLS sources without a cached playlist"""
+        playlists = [url for url in sources if '.m3u8' in url.lower()][:HLS_INSPECT_MAX]
+        pending = [url for url in playlists if self.get(url) is None]
+        with self.lock:
+            self.stats['hits'] += len(playlists) - len(pending)
+        return pending
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, enabled=HLS_INSPECT, entries=len(self.entries))
+
+# Headless browser fallback settings: only used when static extraction finds
+# nothing, and only with selenium and chromium/chromedriver installed
+BROWSER_FALLBACK = os.environ.get('BROWSER_FALLBACK', '0') == '1'
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 2))  # also the pages open at once
+BROWSER_PAGE_TIMEOUT = float(os.environ.get('BROWSER_PAGE_TIMEOUT', 15))
+BROWSER_SETTLE_TIME = float(os.environ.get('BROWSER_SETTLE_TIME', 1))  # listen on after the first media request
+BROWSER_KILL_GRACE = float(os.environ.get('BROWSER_KILL_GRACE', 5))  # past the page timeout
+BROWSER_MAX_PAGES = int(os.environ.get('BROWSER_MAX_PAGES', 100))  # pages before a browser is relaunched
+BROWSER_BINARY = os.environ.get('BROWSER_BINARY', '')
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', '')
+BROWSER_MEDIA_PATTERN = re.compile(r'\.(?:m3u8|mpd|mp4)(?:[?#]|$)', re.IGNORECASE)
+BROWSER_MEDIA_TYPES = ('mpegurl', 'dash+xml', 'video/mp4')
+
+if BROWSER_FALLBACK and webdriver is None:
+    logger.warning("BROWSER_FALLBACK is set but selenium is not installed; browser fallback disabled")
+    BROWSER_FALLBACK = False
+
+def launch_browser():
+    """Start a headless Chromium that records network activity in its performance log"""
+    options = webdriver.ChromeOptions()
+    for argument in ('--headless=new', '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu',
+                     '--mute-audio', '--autoplay-policy=no-user-gesture-required',
+                     '--blink-settings=imagesEnabled=false'):
+        options.add_argument(argument)
+    # Headless Chrome announces itself in its default User-Agent
+    user_agent = get_random_headers()['User-Agent']
+    if 'Chrome/' in user_agent:
+        options.add_argument(f"--user-agent={user_agent}")
+    if BROWSER_BINARY:
+        options.binary_location = BROWSER_BINARY
+    options.page_load_strategy = 'eager'
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    service = ChromeService(executable_path=CHROMEDRIVER_PATH) if CHROMEDRIVER_PATH else ChromeService()
+    return webdriver.Chrome(options=options, service=service)
+
+def media_requests(log_entries):
+    """Media URLs in Chrome performance log entries, by request extension or response MIME type"""
+    urls = []
+    for entry in log_entries:
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, TypeError, ValueError):
+            continue
+        params = message.get('params') or {}
+        if message.get('method') == 'Network.requestWillBeSent':
+            url = params.get('request', {}).get('url', '')
+            if BROWSER_MEDIA_PATTERN.search(url):
+                urls.append(url)
+        elif message.get('method') == 'Network.responseReceived':
+            response = params.get('response', {})
+            if any(media_type in response.get('mimeType', '').lower() for media_type in BROWSER_MEDIA_TYPES):
+                urls.append(response.get('url', ''))
+    return [url for url in urls if url.startswith(('http://', 'https://'))]
+
+class BrowserPool:
+    """Pre-launched headless browsers reused across pages; each borrower gets one to itself.
+
+    start() launches the browsers in the background so the first fallback
+    does not pay the cold start. A page gets a hard time limit: past the
+    page timeout plus BROWSER_KILL_GRACE its browser is quit from a watchdog
+    timer. Browsers that fail or have served BROWSER_MAX_PAGES pages are
+    quit and relaunched on demand.
+    """
+
+    def __init__(self, factory=launch_browser, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES):
+        self.factory = factory
+        self.size = size
+        self.max_pages = max_pages
+        self.idle = queue.LifoQueue()  # (driver, pages served)
+        self.created = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {'launches': 0, 'launch_errors': 0, 'pages': 0, 'page_errors': 0, 'timeouts': 0,
+                      'killed': 0, 'recycled': 0, 'media_found': 0}
+        atexit.register(self.close)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def start(self):
+        """Launch the browsers in a daemon thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.warm, name='browser-warmup', daemon=True)
+            self.thread.start()
+
+    def warm(self):
+        try:
+            while True:
+                driver = self.launch()
+                if driver is None:
+                    return
+                self.idle.put((driver, 0))
+        except Exception as e:
+            logger.error(f"Browser warm-up stopped: {e}")
+
+    def launch(self):
+        """Launch a browser if the pool has room, else return None"""
+        with self.lock:
+            if self.closed or self.created >= self.size:
+                return None
+            self.created += 1
+        try:
+            driver = self.factory()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+                self.stats['launch_errors'] += 1
+            raise
+        self.count('launches')
+        return driver
+
+    def acquire(self, timeout):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        driver = self.launch()
+        if driver is not None:
+            return driver, 0
+        try:
+            return self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No browser available within {timeout}s") from None
+
+    def release(self, driver, pages, healthy):
+        if healthy and pages < self.max_pages and not self.closed:
+            self.idle.put((driver, pages))
+            return
+        if healthy:
+            self.count('recycled')
+        self.discard(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            self.created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def capture(self, url, timeout):
+        """Load url in a pooled browser and return the media URLs it requested"""
+        started = time.monotonic()
+        driver, pages = self.acquire(timeout)
+        page_timeout = max(MIN_FETCH_TIMEOUT, timeout - (time.monotonic() - started))
+        watchdog = threading.Timer(page_timeout + BROWSER_KILL_GRACE, self.kill, (driver,))
+        watchdog.daemon = True
+        watchdog.start()
+        healthy = False
+        try:
+            media = self.load(driver, url, page_timeout)
+            healthy = True
+        except Exception:
+            self.count('page_errors')
+            raise
+        finally:
+            watchdog.cancel()
+            self.release(driver, pages + 1, healthy)
+        self.count('pages')
+        self.count('media_found', len(media))
+        return media
+
+    def kill(self, driver):
+        """Watchdog: quit a browser stuck past its page budget, failing the call blocked on it"""
+        logger.warning("Killing a browser stuck past its page timeout")
+        self.count('killed')
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def load(self, driver, url, timeout):
+        """Open url and collect media requests until they settle or the timeout runs out"""
+        deadline = time.monotonic() + timeout
+        # Drain entries the previous page left in the log
+        driver.get_log('performance')
+        driver.set_page_load_timeout(timeout)
+        try:
+            driver.get(url)
+        except PageLoadTimeout:
+            # Players often keep loading; what was requested so far still counts
+            self.count('timeouts')
+        
+        media = []
+        settle_at = None
+        while True:
+            for found in media_requests(driver.get_log('performance')):
+                if found not in media:
+                    media.append(found)
+            now = time.monotonic()
+            if media and settle_at is None:
+                settle_at = now + BROWSER_SETTLE_TIME
+            if now >= deadline or (settle_at is not None and now >= settle_at):
+                break
+            time.sleep(0.1)
+        
+        # Stop playback and pending requests before the next borrower
+        driver.get('about:blank')
+        return media
+
+    def close(self):
+        """Quit the idle browsers; borrowed ones are quit when released"""
+        self.closed = True
+        while True:
+            try:
+                driver, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(driver)
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, enabled=True, size=self.size, created=self.created, idle=self.idle.qsize())
+
+# Candidate URL probing settings
+PROBE_CONCURRENCY = int(os.environ.get('PROBE_CONCURRENCY', 4))  # 1 = sequential
+PROBE_MODE = os.environ.get('PROBE_MODE', 'first')  # 'first' or 'best'
+
 class EnhancedVidFastScraper:
     def __init__(self):
-        # Use cloudscraper to handle Cloudflare protection
-        self.scraper = cloudscraper.create_scraper(
+        # Pooled cloudscraper instances to handle Cloudflare protection
+        self.scraper_pool = SessionPool(lambda: mount_http_adapters(cloudscraper.create_scraper(
             browser={
                 'browser': 'chrome',
                 'platform': 'windows',
@@ -75,10 +1789,34 @@ class EnhancedVidFastScraper:
             },
             delay=1,
             debug=False
-        )
+        )))
+        
+        # Backup sessions for non-Cloudflare requests
+        self.session_pool = SessionPool(lambda: mount_http_adapters(requests.Session()))
+        
+        # Cloudflare clearance shared across sessions and restarts
+        self.clearance = ClearanceStore()
+        
+        # Shared per-host request pacing
+        self.rate_limiter = HostRateLimiter()
+        
+        # Learned preference between the candidate URL templates
+        self.template_index = TemplateIndex()
+        
+        # Deobfuscation results for repeated inline scripts
+        self.script_memo = ScriptMemo()
+        
+        # Liveness and time-to-first-byte of returned sources
+        self.verifier = SourceVerifier()
+        
+        # Variant streams listed by HLS master playlists
+        self.manifests = ManifestCache()
+        
+        # Nested iframe fetches for all requests share one bounded pool
+        self.iframe_pool = SharedPool(IFRAME_WORKERS, 'iframe')
         
-        # Backup session for non-Cloudflare requests
-        self.session = requests.Session()
+        # Headless browsers for players that only reveal sources to JavaScript
+        self.browsers = BrowserPool() if BROWSER_FALLBACK else None
         
         # Possible base URLs to try
         self.base_urls = [
@@ -88,25 +1826,36 @@ class EnhancedVidFastScraper:
             "https://vidfast.net"
         ]
         
-        self.working_base_url = None
-        self.find_working_base_url()
+        # Mirror health is probed in the background; start() kicks it off
+        self.mirrors = MirrorMonitor(self.base_urls, self.probe_mirror)
+    
+    @property
+    def working_base_url(self):
+        return self.mirrors.current
+    
+    @working_base_url.setter
+    def working_base_url(self, url):
+        self.mirrors.current = url
+    
+    def start(self):
+        """Start background mirror monitoring and browser warm-up"""
+        if MIRROR_MONITOR:
+            self.mirrors.start()
+        if self.browsers is not None:
+            self.browsers.start()
+    
+    def probe_mirror(self, url):
+        """Check whether a mirror base URL answers"""
+        self.rate_limiter.acquire(url)
+        response = self.fetch(url, get_random_headers(), MIRROR_PROBE_TIMEOUT)
+        metrics.inc('upstream_responses_total', kind='mirror', status=response.status_code)
+        self.rate_limiter.on_response(url, response.status_code, response.headers.get('Retry-After'))
+        return response.status_code == 200
     
     def find_working_base_url(self):
-        """Find the working base URL"""
-        for url in self.base_urls:
-            try:
-                response = self.scraper.get(url, timeout=10)
-                if response.status_code == 200:
-                    self.working_base_url = url
-                    logger.info(f"Found working base URL: {url}")
-                    return
-            except Exception as e:
-                logger.debug(f"Failed to connect to {url}: {e}")
-                continue
-        
-        # If all fail, use the first one as fallback
-        self.working_base_url = self.base_urls[0]
-        logger.warning(f"No working base URL found, using fallback: {self.working_base_url}")
+        """Probe all mirrors now and use the fastest healthy one"""
+        self.mirrors.probe_all()
+        logger.info(f"Using base URL: {self.working_base_url}")
     
     def extract_id(self, id_str):
         """Extract clean ID from different formats"""
@@ -114,106 +1863,474 @@ class EnhancedVidFastScraper:
             return id_str.replace('tmdb:', '')
         return id_str
     
-    def get_page_content(self, url, use_cloudscraper=True):
+    def get_page_content(self, url, use_cloudscraper=True, deadline=None):
         """Fetch page content with enhanced error handling and Cloudflare bypass"""
         headers = get_random_headers()
         
+        # Time we can spend waiting for a rate limit slot and still fetch
+        wait_budget = None
+        if deadline:
+            wait_budget = deadline.remaining() - MIN_FETCH_TIMEOUT
+            if wait_budget < 0:
+                logger.warning(f"Deadline reached, skipping fetch of {url}")
+                return None
+        
+        if not self.rate_limiter.acquire(url, wait_budget):
+            logger.warning(f"Rate limit wait would overrun the deadline, skipping fetch of {url}")
+            return None
+        
+        timeout = deadline.timeout(15) if deadline else 15
+        response = None
         try:
-            if use_cloudscraper:
-                response = self.scraper.get(url, headers=headers, timeout=15)
-            else:
-                self.session.headers.update(headers)
-                response = self.session.get(url, timeout=15)
+            with metrics.stage('page_fetch', url=url, cloudscraper=use_cloudscraper):
+                response = self.fetch(url, headers, timeout, use_cloudscraper, stream=STREAM_EARLY_EXIT)
+            metrics.inc('upstream_responses_total', kind='page', status=response.status_code)
             
+            self.rate_limiter.on_response(url, response.status_code, response.headers.get('Retry-After'))
+            # A 4xx from a mirror means a wrong path, not a mirror that is down
+            self.mirrors.report(url, ok=response.status_code < 500)
             response.raise_for_status()
-            return response.text
+            with metrics.stage('page_read', url=url):
+                if STREAM_EARLY_EXIT:
+                    return self.read_streaming(response, url, deadline)
+                return response.text
         except Exception as e:
+            if response is not None:
+                response.close()
+            else:
+                metrics.inc('upstream_responses_total', kind='page',
+                            status='timeout' if isinstance(e, requests.Timeout) else 'error')
             logger.error(f"Failed to fetch {url}: {e}")
+            if not isinstance(e, requests.HTTPError):
+                self.mirrors.report(url, ok=False)
             
             # Try with backup method
             if use_cloudscraper:
+                metrics.inc('fallbacks_total', kind='session_retry')
+                metrics.event('fallback', kind='session_retry', url=url)
                 logger.info("Retrying with regular session...")
-                return self.get_page_content(url, use_cloudscraper=False)
+                return self.get_page_content(url, use_cloudscraper=False, deadline=deadline)
             
             return None
     
-    def extract_video_sources(self, html_content, page_url):
-        """Enhanced video source extraction with multiple patterns"""
-        soup = BeautifulSoup(html_content, 'html.parser')
-        sources = []
+    def read_streaming(self, response, url, deadline=None):
+        """Read a streamed body, stopping early once enough good sources are in it"""
+        scanner = EarlyExitScanner(self, response.encoding)
+        try:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    logger.info(f"Enough sources after {scanner.bytes_read} bytes, closing {url} early")
+                    break
+                if deadline and deadline.expired():
+                    logger.warning(f"Deadline reached while reading {url}, using partial page")
+                    break
+        finally:
+            response.close()
         
-        # Enhanced patterns for modern streaming sites
-        video_patterns = [
-            # Standard video/source tags
-            r'<video[^>]*src=["\']([^"\']+)["\']',
-            r'<source[^>]*src=["\']([^"\']+)["\']',
-            
-            # JavaScript video configurations
-            r'src\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
-            r'file\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
-            r'video\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
-            r'url\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
-            r'link\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
-            
-            # HLS and DASH streams
-            r'["\']([^"\']+\.m3u8(?:\?[^"\']*)?)["\']',
-            r'["\']([^"\']+\.mpd(?:\?[^"\']*)?)["\']',
-            
-            # MP4 and other video formats
-            r'["\']([^"\']+\.mp4(?:\?[^"\']*)?)["\']',
-            r'["\']([^"\']+\.webm(?:\?[^"\']*)?)["\']',
-            r'["\']([^"\']+\.avi(?:\?[^"\']*)?)["\']',
-            r'["\']([^"\']+\.mkv(?:\?[^"\']*)?)["\']',
-            
-            # Streaming URLs with common patterns
-            r'["\']([^"\']*(?:stream|video|play|embed|player)[^"\']*\.(?:m3u8|mp4|webm|ts)(?:\?[^"\']*)?)["\']',
-            
-            # Base64 encoded sources
-            r'atob\s*\(\s*["\']([^"\']+)["\']',
-            
-            # Common streaming parameters
-            r'playlist\s*:\s*["\']([^"\']+)["\']',
-            r'manifest\s*:\s*["\']([^"\']+)["\']',
-        ]
+        return scanner.text()
+    
+    def fetch(self, url, headers, timeout, use_cloudscraper=True, stream=False):
+        """GET a URL on a pooled session with per-request headers and shared clearance"""
+        host = urlparse(url).netloc.lower()
+        pool = self.scraper_pool if use_cloudscraper else self.session_pool
         
-        for pattern in video_patterns:
-            matches = re.findall(pattern, html_content, re.IGNORECASE | re.DOTALL)
-            for match in matches:
-                # Handle base64 encoded URLs
-                if pattern.startswith('atob'):
+        def send(session):
+            request_headers, cookies = dict(headers), None
+            clearance = self.clearance.get(host)
+            if clearance:
+                cookies = clearance['cookies']
+                if clearance['user_agent']:
+                    request_headers['User-Agent'] = clearance['user_agent']
+            response = session.get(url, headers=request_headers, cookies=cookies, timeout=timeout, stream=stream)
+            if use_cloudscraper:
+                self.clearance.harvest(host, session, response)
+            return response
+        
+        with pool.borrow(timeout) as session:
+            if use_cloudscraper and self.clearance.needs_solve(host):
+                # Only one worker solves a host's challenge; the rest wait and reuse it
+                with self.clearance.solve_lock(host):
+                    return send(session)
+            return send(session)
+    
+    def fetch_candidate_sources(self, page_url, deadline=None, crawl=None):
+        """Fetch one candidate page and extract its sources"""
+        content = self.get_page_content(page_url, deadline=deadline)
+        if content:
+            return self.extract_video_sources(content, page_url, deadline=deadline, crawl=crawl)
+        return []
+    
+    def candidate_waves(self, content_type, candidates):
+        """Return the {template: url} candidates as waves of URLs, and the on_result callback recording them"""
+        base_url = self.working_base_url
+        templates_by_url = {url: template for template, url in candidates.items()}
+        
+        def on_result(page_url, found, elapsed):
+            self.template_index.record(base_url, content_type, templates_by_url[page_url], found, elapsed)
+        
+        waves = self.template_index.plan(base_url, content_type, list(candidates))
+        return [[candidates[template] for template in wave] for wave in waves], on_result
+    
+    def find_sources(self, content_type, candidates, deadline=None):
+        """Probe {template: url} candidates in the order the template index prefers"""
+        deadline = deadline or Deadline()
+        crawl = IframeCrawl()
+        waves, on_result = self.candidate_waves(content_type, candidates)
+        for wave in waves:
+            page_url, sources = self.probe_candidate_urls(wave, deadline, on_result, crawl)
+            if sources or deadline.expired():
+                return page_url, sources
+        
+        return None, []
+    
+    def probe_candidate_urls(self, candidate_urls, deadline=None, on_result=None, crawl=None):
+        """Return (url, sources) from the candidate pages, probed concurrently when PROBE_CONCURRENCY > 1"""
+        deadline = deadline or Deadline()
+        crawl = crawl or IframeCrawl()
+        for page_url in candidate_urls:
+            crawl.claim(page_url)
+        
+        def probe(page_url):
+            started = time.monotonic()
+            with metrics.stage('candidate', url=page_url):
+                sources = self.fetch_candidate_sources(page_url, deadline, crawl)
+            if on_result and not deadline.expired():
+                on_result(page_url, bool(sources), time.monotonic() - started)
+            return sources
+        
+        if PROBE_CONCURRENCY <= 1 or len(candidate_urls) <= 1:
+            for page_url in candidate_urls:
+                if deadline.expired():
+                    break
+                logger.info(f"Trying URL: {page_url}")
+                sources = probe(page_url)
+                if sources:
+                    return page_url, sources
+            return self.partial_result(deadline)
+        
+        executor = ThreadPoolExecutor(
+            max_workers=min(PROBE_CONCURRENCY, len(candidate_urls)),
+            thread_name_prefix='probe'
+        )
+        try:
+            futures = {}
+            for page_url in candidate_urls:
+                logger.info(f"Probing URL: {page_url}")
+                futures[submit_traced(executor, probe, page_url)] = page_url
+            
+            results = {}
+            try:
+                for future in as_completed(futures, timeout=deadline.remaining()):
+                    page_url = futures[future]
                     try:
-                        decoded = base64.b64decode(match).decode('utf-8')
-                        if self.is_valid_video_url(decoded):
-                            sources.append(decoded)
-                    except:
+                        sources = future.result()
+                    except Exception as e:
+                        logger.error(f"Probe failed for {page_url}: {e}")
                         continue
-                elif self.is_valid_video_url(match):
-                    sources.append(match)
+                    
+                    if sources:
+                        if PROBE_MODE != 'best':
+                            return page_url, sources
+                        results[page_url] = sources
+            except TimeoutError:
+                logger.warning("Deadline reached while probing candidate URLs")
+            
+            return self.best_candidate(candidate_urls, results, deadline)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def best_candidate(self, candidate_urls, results, deadline):
+        """Return the candidate whose top source ranks highest, ties going to the earlier template"""
+        if not results:
+            return self.partial_result(deadline)
+        best_url = max(
+            (url for url in candidate_urls if url in results),
+            key=lambda url: (self.get_quality_score(results[url][0]), -candidate_urls.index(url))
+        )
+        return best_url, results[best_url]
+    
+    def partial_result(self, deadline):
+        """Return the best sources recorded before the deadline, if any"""
+        sources = deadline.best_sources()
+        if sources and deadline.expired():
+            metrics.inc('fallbacks_total', kind='partial_result')
+            metrics.event('fallback', kind='partial_result', sources=len(sources))
+            logger.warning(f"Returning {len(sources)} partial sources after deadline")
+            return None, self.sort_sources_by_quality(sources)
+        return None, []
+    
+    def probe_source(self, url, timeout):
+        """Ask a source for its first byte and record whether it answered and how fast"""
+        headers = get_random_headers()
+        headers['Range'] = 'bytes=0-0'
+        started = time.monotonic()
+        try:
+            response = self.fetch(url, headers, timeout, use_cloudscraper=False, stream=True)
+            response.close()
+            metrics.inc('upstream_responses_total', kind='verify', status=response.status_code)
+            self.verifier.set(url, self.verifier.classify(response.status_code), time.monotonic() - started)
+        except requests.Timeout:
+            # Slower than the budget is not the same as dead
+            metrics.inc('upstream_responses_total', kind='verify', status='timeout')
+            logger.info(f"Source probe timed out: {url}")
+            self.verifier.set(url, None, None)
+        except Exception as e:
+            metrics.inc('upstream_responses_total', kind='verify', status='error')
+            logger.info(f"Source probe failed for {url}: {e}")
+            self.verifier.set(url, False, None)
+    
+    def run_probes(self, probe, urls, budget, concurrency, name):
+        """Call probe(url, budget) for every URL concurrently; return the URLs unfinished after budget"""
+        executor = ThreadPoolExecutor(max_workers=min(concurrency, len(urls)), thread_name_prefix=name)
+        try:
+            futures = {submit_traced(executor, probe, url, budget): url for url in urls}
+            _, not_done = wait(futures, timeout=budget)
+            if not_done:
+                logger.warning(f"{len(not_done)} {name} probes unfinished within {budget:.1f}s")
+            return [futures[future] for future in not_done]
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def verify_pending(self, sources, deadline=None):
+        """Return (sources to probe, budget) for liveness verification; none once the budget is spent"""
+        budget = min(VERIFY_BUDGET, deadline.remaining()) if deadline else VERIFY_BUDGET
+        pending = self.verifier.pending(sources)
+        return (pending if budget > 0 else []), budget
+    
+    def verify_ranked(self, sources, unfinished):
+        """Record probes that overran the budget as unconfirmed and rank by score and TTFB"""
+        for url in unfinished:
+            self.verifier.set(url, None, None)
+        return self.verifier.rank(sources, self.get_quality_score)
+    
+    def verify_sources(self, sources, deadline=None):
+        """Probe the top sources concurrently, drop dead ones and rank by score and TTFB"""
+        pending, budget = self.verify_pending(sources, deadline)
+        unfinished = self.run_probes(self.probe_source, pending, budget, VERIFY_CONCURRENCY, 'verify') if pending else []
+        return self.verify_ranked(sources, unfinished)
+    
+    def fetch_playlist(self, url, timeout):
+        """Fetch an HLS playlist and cache the variant streams it lists"""
+        started = time.monotonic()
+        try:
+            response = self.fetch(url, get_random_headers(), timeout, use_cloudscraper=False, stream=True)
+            metrics.inc('upstream_responses_total', kind='playlist', status=response.status_code)
+            try:
+                # Fetching the playlist proves liveness too, so verification can skip it
+                self.verifier.set(url, self.verifier.classify(response.status_code), time.monotonic() - started)
+                response.raise_for_status()
+                body = bytearray()
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    body.extend(chunk)
+                    if len(body) >= HLS_MAX_PLAYLIST_BYTES:
+                        break
+            finally:
+                response.close()
+        except Exception as e:
+            if not isinstance(e, requests.HTTPError):
+                metrics.inc('upstream_responses_total', kind='playlist',
+                            status='timeout' if isinstance(e, requests.Timeout) else 'error')
+            logger.info(f"Playlist fetch failed for {url}: {e}")
+            self.manifests.set(url, None)
+            return
+        
+        self.manifests.set(url, parse_master_playlist(body.decode('utf-8', errors='replace')))
+    
+    def playlist_pending(self, sources, deadline=None):
+        """Return (playlists to fetch, budget) for HLS inspection; none once the budget is spent"""
+        budget = min(HLS_INSPECT_BUDGET, deadline.remaining()) if deadline else HLS_INSPECT_BUDGET
+        pending = self.manifests.pending(sources)
+        return (pending if budget > 0 else []), budget
+    
+    def playlists_ranked(self, sources, unfinished):
+        """Record playlist fetches that overran the budget as failed and re-rank by the real variants"""
+        for url in unfinished:
+            self.manifests.set(url, None)
+        return self.sort_sources_by_quality(sources)
+    
+    def inspect_playlists(self, sources, deadline=None):
+        """Fetch the top HLS master playlists concurrently and re-rank by their real variants"""
+        pending, budget = self.playlist_pending(sources, deadline)
+        unfinished = self.run_probes(self.fetch_playlist, pending, budget, HLS_INSPECT_CONCURRENCY, 'playlist') if pending else []
+        return self.playlists_ranked(sources, unfinished)
+    
+    def ranking_stages(self):
+        """The enabled post-scrape ranking stages, in order, as (metrics stage, engine method name)"""
+        stages = []
+        if HLS_INSPECT:
+            stages.append(('playlist_inspect', 'inspect_playlists'))
+        if VERIFY_SOURCES:
+            stages.append(('verify', 'verify_sources'))
+        return stages
+    
+    def rank_sources(self, sources, deadline=None):
+        """Optional post-scrape ranking stages: playlist introspection, then liveness"""
+        for stage, method in self.ranking_stages():
+            with metrics.stage(stage):
+                sources = getattr(self, method)(sources, deadline)
+        return sources
+    
+    def browser_sources(self, page_url, deadline=None):
+        """Last resort: open the player in a headless browser and collect the media it requests"""
+        timeout = deadline.timeout(BROWSER_PAGE_TIMEOUT) if deadline else BROWSER_PAGE_TIMEOUT
+        if self.browsers is None or timeout < MIN_FETCH_TIMEOUT:
+            if self.browsers is not None:
+                logger.info(f"Skipping browser fallback for {page_url}: {timeout:.1f}s left")
+            return []
+        try:
+            with metrics.stage('browser', url=page_url):
+                sources = self.browsers.capture(page_url, timeout)
+        except Exception as e:
+            logger.warning(f"Browser fallback failed for {page_url}: {e!r}")
+            return []
+        if sources:
+            metrics.inc('fallbacks_total', kind='browser')
+            metrics.event('fallback', kind='browser', sources=len(sources))
+            logger.info(f"Browser captured {len(sources)} sources from {page_url}")
+        return self.sort_sources_by_quality(sources)
+    
+    def extract_video_sources(self, html_content, page_url, deadline=None, crawl=None, depth=0):
+        """Enhanced video source extraction with multiple patterns"""
+        crawl = crawl or IframeCrawl()
+        page_sources, iframe_urls = self.extract_page_sources(html_content, page_url)
+        
+        # Keep what this page yields on its own in case iframe hops overrun the deadline
+        crawl.record(page_sources, self.get_quality_score)
+        if deadline:
+            deadline.record(page_sources)
+        
+        sources = list(page_sources)
+        iframe_urls = self.claim_iframes(iframe_urls, crawl, depth)
+        if iframe_urls:
+            # Try to extract sources from iframes
+            sources.extend(self.crawl_iframes(iframe_urls, deadline, crawl, depth + 1))
+        
+        return self.sort_sources_by_quality(self.clean_sources(sources, page_url))
+    
+    def extract_page_sources(self, html_content, page_url):
+        """Return a page's own sources and the streaming iframe URLs it embeds"""
+        with metrics.stage('parse', url=page_url, bytes=len(html_content)):
+            iframe_srcs, scripts = self.parse_page_elements(html_content)
+        sources = []
+        
+        # Single pass over the document with the combined source pattern,
+        # already done while the page streamed in if it was read that way
+        with metrics.stage('regex_scan', url=page_url):
+            matches = getattr(html_content, 'source_matches', None)
+            if matches is None:
+                matches = self.scan_video_sources(html_content)
+            for kind, match in matches:
+                source = self.source_from_match(kind, match)
+                if source:
+                    sources.append(source)
+        
+        # Look for encrypted or obfuscated sources
+        with metrics.stage('deobfuscate', url=page_url, scripts=len(scripts)):
+            for script in scripts:
+                # Look for common obfuscation patterns
+                obfuscated_sources = self.script_memo.extract(script, self.extract_obfuscated_sources)
+                sources.extend(obfuscated_sources)
         
         # Extract iframe sources with enhanced detection
-        iframes = soup.find_all('iframe')
-        for iframe in iframes:
-            src = iframe.get('src') or iframe.get('data-src')
+        iframe_urls = []
+        for src in iframe_srcs:
             if src and self.is_streaming_iframe(src):
                 # Make URL absolute
                 if src.startswith('//'):
                     src = 'https:' + src
                 elif src.startswith('/'):
                     src = urljoin(page_url, src)
-                
-                # Try to extract sources from iframe
-                iframe_sources = self.scrape_iframe_sources(src)
-                sources.extend(iframe_sources)
+                iframe_urls.append(src)
         
-        # Look for encrypted or obfuscated sources
-        script_tags = soup.find_all('script')
-        for script in script_tags:
-            if script.string:
-                # Look for common obfuscation patterns
-                obfuscated_sources = self.extract_obfuscated_sources(script.string)
-                sources.extend(obfuscated_sources)
+        return self.clean_sources(sources, page_url), iframe_urls
+    
+    def claim_iframes(self, iframe_urls, crawl, depth):
+        """Filter iframe URLs down to unvisited ones within the depth limit"""
+        claimed = []
+        for src in iframe_urls:
+            if depth >= crawl.max_depth:
+                logger.info(f"Max iframe depth reached, skipping iframe: {src}")
+            elif crawl.claim(src):
+                claimed.append(src)
+        if iframe_urls:
+            metrics.observe('iframe_fanout', len(claimed))
+        return claimed
+    
+    def crawl_iframes(self, iframe_urls, deadline, crawl, depth):
+        """Scrape sibling iframes, concurrently on the shared iframe pool when IFRAME_CONCURRENCY > 1"""
+        def should_stop():
+            if crawl.enough():
+                logger.info("Enough sources found, skipping remaining iframes")
+                return True
+            if deadline and deadline.expired():
+                logger.warning("Deadline reached, skipping remaining iframes")
+                return True
+            return False
+        
+        sources = []
+        if IFRAME_CONCURRENCY <= 1 or len(iframe_urls) == 1:
+            for iframe_url in iframe_urls:
+                if should_stop():
+                    break
+                sources.extend(self.scrape_iframe_sources(iframe_url, deadline, crawl, depth))
+            return sources
+        
+        pending = deque(iframe_urls)
+        running = set()
+        while pending and not should_stop():
+            while pending and len(running) < IFRAME_CONCURRENCY - 1:
+                future = self.iframe_pool.submit(self.scrape_iframe_sources, pending[0], deadline, crawl, depth)
+                if future is None:
+                    break
+                running.add(future)
+                pending.popleft()
+            if pending:
+                # No free worker, or this page's share is in use: work through one here
+                sources.extend(self.scrape_iframe_sources(pending.popleft(), deadline, crawl, depth))
+            for future in [future for future in running if future.done()]:
+                running.discard(future)
+                sources.extend(future.result())
+        
+        # Collect the running iframes; once the crawl has enough they only get
+        # a short grace period, otherwise they are waited on up to the deadline
+        while running:
+            timeout = crawl.wait_timeout(deadline)
+            if timeout == 0:
+                break
+            done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                sources.extend(future.result())
+        
+        for future in [future for future in running if future.done()]:
+            running.discard(future)
+            sources.extend(future.result())
+        if running:
+            logger.warning(f"Abandoning {len(running)} iframes still running")
+        
+        return sources
+    
+    def parse_page_elements(self, html_content):
+        """Return (iframe srcs, inline script texts) for a page.
+
+        The lxml pass streams parser events into PageElementsTarget, so no
+        document tree is built. Markup lxml cannot handle goes through the
+        full BeautifulSoup parse instead.
+        """
+        if HTML_PARSER == 'lxml' and lxml_etree is not None and html_content:
+            try:
+                parser = lxml_etree.HTMLParser(target=PageElementsTarget())
+                return lxml_etree.fromstring(html_content, parser)
+            except Exception as e:
+                metrics.inc('fallbacks_total', kind='bs4_parse')
+                logger.debug(f"lxml parse failed, falling back to BeautifulSoup: {e}")
         
-        # Remove duplicates and make URLs absolute
+        soup = BeautifulSoup(html_content, 'html.parser')
+        iframe_srcs = [iframe.get('src') or iframe.get('data-src') for iframe in soup.find_all('iframe')]
+        scripts = [script.string for script in soup.find_all('script') if script.string]
+        return iframe_srcs, scripts
+    
+    def clean_sources(self, sources, page_url):
+        """Remove duplicates and make URLs absolute"""
         clean_sources = []
         for source in set(sources):
             if source.startswith('//'):
@@ -224,7 +2341,34 @@ class EnhancedVidFastScraper:
             if self.is_valid_video_url(source) and source not in clean_sources:
                 clean_sources.append(source)
         
-        return self.sort_sources_by_quality(clean_sources)
+        return clean_sources
+    
+    def scan_video_sources(self, html_content):
+        """Yield (kind, match) for every candidate source in one scan.
+
+        Kinds are 'tag' (<video>/<source> src), 'atob' (base64 payload),
+        'config' (playlist:/manifest: keys), 'config_media' (src:/file:/
+        video:/url:/link: keys pointing at media files) and 'media' (quoted
+        HLS/DASH/MP4 and streaming URLs). Each distinct match is yielded once.
+        """
+        seen = set()
+        for m in VIDEO_SOURCE_PATTERN.finditer(html_content):
+            kind = m.lastgroup
+            match = m.group(kind)
+            if (kind, match) not in seen:
+                seen.add((kind, match))
+                yield kind, match
+    
+    def source_from_match(self, kind, match):
+        """Turn a scanner match into a valid source URL, or None"""
+        # Handle base64 encoded URLs
+        if kind == 'atob':
+            try:
+                match = base64.b64decode(match).decode('utf-8')
+            except:
+                return None
+        
+        return match if self.is_valid_video_url(match) else None
     
     def extract_obfuscated_sources(self, script_content):
         """Extract sources from obfuscated JavaScript"""
@@ -244,7 +2388,7 @@ class EnhancedVidFastScraper:
         try:
             decoded_script = script_content.encode().decode('unicode_escape')
             # Look for video URLs in decoded content
-            video_urls = re.findall(r'["\']([^"\']+\.(?:m3u8|mp4|webm|ts)(?:\?[^"\']*)?)["\']', decoded_script)
+            video_urls = OBFUSCATED_SOURCE_PATTERN.findall(decoded_script)
             for url in video_urls:
                 if self.is_valid_video_url(url):
                     sources.append(url)
@@ -262,22 +2406,20 @@ class EnhancedVidFastScraper:
         if url.startswith(('data:', 'javascript:', 'about:', 'mailto:')):
             return False
         
+        url_lower = url.lower()
+        
         # Skip obvious non-video URLs
-        if any(x in url.lower() for x in ['font', 'css', 'js', 'json', 'xml', 'txt', 'png', 'jpg', 'jpeg', 'gif', 'svg', 'ico']):
+        if any(x in url_lower for x in NON_VIDEO_MARKERS):
             return False
         
         # Check for video file extensions
-        video_extensions = ['.m3u8', '.mp4', '.webm', '.avi', '.mkv', '.mov', '.flv', '.ts', '.mpd']
-        url_lower = url.lower()
-        
-        if any(ext in url_lower for ext in video_extensions):
+        if any(ext in url_lower for ext in VIDEO_EXTENSIONS):
             return True
         
         # Check for streaming indicators
-        streaming_indicators = ['stream', 'video', 'play', 'embed', 'player', 'watch', 'media']
-        if any(indicator in url_lower for indicator in streaming_indicators):
+        if any(indicator in url_lower for indicator in STREAMING_INDICATORS):
             # Additional checks for streaming URLs
-            if any(x in url_lower for x in ['hls', 'dash', 'manifest', 'playlist']):
+            if any(x in url_lower for x in STREAMING_FORMAT_MARKERS):
                 return True
             
             # Check if it's a proper streaming domain
@@ -299,59 +2441,82 @@ class EnhancedVidFastScraper:
         url_lower = url.lower()
         return any(indicator in url_lower for indicator in streaming_indicators)
     
-    def scrape_iframe_sources(self, iframe_url):
+    def scrape_iframe_sources(self, iframe_url, deadline=None, crawl=None, depth=1):
         """Enhanced iframe scraping with retry logic"""
+        metrics.observe('iframe_depth', depth)
         try:
             logger.info(f"Scraping iframe: {iframe_url}")
             
-            # Add delay to avoid rate limiting
-            time.sleep(random.uniform(1, 3))
-            
-            content = self.get_page_content(iframe_url)
-            if content:
-                return self.extract_video_sources(content, iframe_url)
+            with metrics.stage('iframe', url=iframe_url, depth=depth):
+                # Per-host pacing happens in get_page_content
+                content = self.get_page_content(iframe_url, deadline=deadline)
+                if content:
+                    return self.extract_video_sources(content, iframe_url, deadline=deadline, crawl=crawl, depth=depth)
         except Exception as e:
             logger.error(f"Failed to scrape iframe {iframe_url}: {e}")
         
         return []
     
-    def sort_sources_by_quality(self, sources):
-        """Enhanced quality sorting"""
+    def get_quality_score(self, url):
+        """Score a source URL by its quality and format hints"""
+        # Real variant resolutions beat guesses from the URL; a playlist that
+        # failed to load ranks below anything that might play
+        variants = self.manifests.get(url)
+        if variants is PLAYLIST_FAILED:
+            return HLS_FAILED_SCORE
+        variant = best_variant(variants)
+        if variant:
+            return HLS_INSPECTED_SCORE + next(
+                (score for height, score in HLS_HEIGHT_SCORES if variant['height'] >= height), 0
+            )
+        
         quality_scores = {
             '4k': 10, '2160p': 10, '1440p': 8, '1080p': 6,
             '720p': 4, '480p': 2, '360p': 1, '240p': 0
         }
         
-        def get_quality_score(url):
-            url_lower = url.lower()
-            
-            # Check for explicit quality indicators
-            for quality, score in quality_scores.items():
-                if quality in url_lower:
-                    return score
-            
-            # Prefer streaming formats
-            if '.m3u8' in url_lower:
-                return 7  # HLS adaptive streaming
-            elif '.mpd' in url_lower:
-                return 7  # DASH adaptive streaming
-            elif '.mp4' in url_lower:
-                return 5  # MP4 direct
-            elif '.webm' in url_lower:
-                return 4  # WebM
-            elif '.ts' in url_lower:
-                return 3  # Transport Stream
-            
-            # Prefer URLs with streaming indicators
-            if any(x in url_lower for x in ['hd', 'high', 'best', 'premium']):
-                return 6
-            
-            return 3  # Default score
+        url_lower = url.lower()
         
-        return sorted(sources, key=get_quality_score, reverse=True)
+        # Check for explicit quality indicators
+        for quality, score in quality_scores.items():
+            if quality in url_lower:
+                return score
+        
+        # Prefer streaming formats
+        if '.m3u8' in url_lower:
+            return 7  # HLS adaptive streaming
+        elif '.mpd' in url_lower:
+            return 7  # DASH adaptive streaming
+        elif '.mp4' in url_lower:
+            return 5  # MP4 direct
+        elif '.webm' in url_lower:
+            return 4  # WebM
+        elif '.ts' in url_lower:
+            return 3  # Transport Stream
+        
+        # Prefer URLs with streaming indicators
+        if any(x in url_lower for x in ['hd', 'high', 'best', 'premium']):
+            return 6
+        
+        return 3  # Default score
+    
+    def sort_sources_by_quality(self, sources):
+        """Enhanced quality sorting"""
+        return sorted(sources, key=self.get_quality_score, reverse=True)
     
     def get_quality_label(self, url):
         """Enhanced quality label detection"""
+        variant = best_variant(self.manifests.get(url))
+        if variant:
+            label = '4K' if variant['height'] >= 2160 else f"{variant['height']}p"
+            details = [f"{label} HLS"]
+            codec = next((name for prefix, name in HLS_CODEC_NAMES if prefix in variant['codecs']), None)
+            if codec:
+                details.append(codec)
+            if variant['bandwidth']:
+                details.append(f"{variant['bandwidth'] / 1e6:.1f} Mbps")
+            return ' · '.join(details)
+        
         url_lower = url.lower()
         
         quality_map = {
@@ -383,41 +2548,41 @@ class EnhancedVidFastScraper:
         
         return 'Stream'
     
-    def scrape_movie(self, movie_id):
-        """Enhanced movie scraping with multiple attempts"""
-        movie_urls = [
-            f"{self.working_base_url}/movie/{movie_id}",
-            f"{self.working_base_url}/watch/{movie_id}",
-            f"{self.working_base_url}/film/{movie_id}",
-            f"{self.working_base_url}/m/{movie_id}"
-        ]
-        
-        for movie_url in movie_urls:
-            logger.info(f"Trying movie URL: {movie_url}")
-            
-            content = self.get_page_content(movie_url)
-            if content:
-                sources = self.extract_video_sources(content, movie_url)
+    def movie_candidates(self, movie_id):
+        """Candidate page URLs for a movie, keyed by URL template"""
+        return {
+            '/movie': f"{self.working_base_url}/movie/{movie_id}",
+            '/watch': f"{self.working_base_url}/watch/{movie_id}",
+            '/film': f"{self.working_base_url}/film/{movie_id}",
+            '/m': f"{self.working_base_url}/m/{movie_id}"
+        }
+    
+    def movie_player_url(self, movie_id):
+        """The autoplaying player page, used for the Direct Link and browser fallbacks"""
+        return f"{self.working_base_url}/movie/{movie_id}?autoPlay=true"
+    
+    def movie_streams(self, movie_id, sources):
+        """Build the stream list for a movie, or the Direct Link fallback"""
+        if sources:
+            streams = []
+            for i, source in enumerate(sources[:5]):  # Limit to top 5
+                quality = self.get_quality_label(source)
                 
-                if sources:
-                    streams = []
-                    for i, source in enumerate(sources[:5]):  # Limit to top 5
-                        quality = self.get_quality_label(source)
-                        
-                        streams.append({
-                            "title": f"🎬 VidFast Enhanced - {quality} (Source {i+1})",
-                            "url": source,
-                            "behaviorHints": {
-                                "notWebReady": False,
-                                "bingeGroup": f"vidfast-movie-{movie_id}",
-                                "countryWhitelist": ["US", "GB", "CA", "AU", "DE", "FR", "IT", "ES", "NL", "BE"]
-                            }
-                        })
-                    
-                    return streams
+                streams.append({
+                    "title": f"🎬 VidFast Enhanced - {quality} (Source {i+1})",
+                    "url": source,
+                    "behaviorHints": {
+                        "notWebReady": False,
+                        "bingeGroup": f"vidfast-movie-{movie_id}",
+                        "countryWhitelist": ["US", "GB", "CA", "AU", "DE", "FR", "IT", "ES", "NL", "BE"]
+                    }
+                })
+            
+            return streams
         
         # Fallback with direct link
-        fallback_url = f"{self.working_base_url}/movie/{movie_id}?autoPlay=true"
+        metrics.inc('fallbacks_total', kind='direct_link')
+        fallback_url = self.movie_player_url(movie_id)
         return [{
             "title": "🎬 VidFast Enhanced - Direct Link",
             "url": fallback_url,
@@ -427,41 +2592,45 @@ class EnhancedVidFastScraper:
             }
         }]
     
-    def scrape_tv_episode(self, series_id, season, episode):
-        """Enhanced TV episode scraping"""
-        tv_urls = [
-            f"{self.working_base_url}/tv/{series_id}/{season}/{episode}",
-            f"{self.working_base_url}/series/{series_id}/{season}/{episode}",
-            f"{self.working_base_url}/watch/{series_id}/{season}/{episode}",
-            f"{self.working_base_url}/s/{series_id}/{season}/{episode}"
-        ]
-        
-        for tv_url in tv_urls:
-            logger.info(f"Trying TV URL: {tv_url}")
-            
-            content = self.get_page_content(tv_url)
-            if content:
-                sources = self.extract_video_sources(content, tv_url)
+    def scrape_movie(self, movie_id, deadline=None):
+        """Enhanced movie scraping with multiple attempts"""
+        return self.scrape_request(('movie', movie_id, None, None), deadline)
+    
+    def episode_candidates(self, series_id, season, episode):
+        """Candidate page URLs for an episode, keyed by URL template"""
+        return {
+            '/tv': f"{self.working_base_url}/tv/{series_id}/{season}/{episode}",
+            '/series': f"{self.working_base_url}/series/{series_id}/{season}/{episode}",
+            '/watch': f"{self.working_base_url}/watch/{series_id}/{season}/{episode}",
+            '/s': f"{self.working_base_url}/s/{series_id}/{season}/{episode}"
+        }
+    
+    def episode_player_url(self, series_id, season, episode):
+        """The autoplaying player page, used for the Direct Link and browser fallbacks"""
+        return f"{self.working_base_url}/tv/{series_id}/{season}/{episode}?autoPlay=true"
+    
+    def episode_streams(self, series_id, season, episode, sources):
+        """Build the stream list for an episode, or the Direct Link fallback"""
+        if sources:
+            streams = []
+            for i, source in enumerate(sources[:5]):
+                quality = self.get_quality_label(source)
                 
-                if sources:
-                    streams = []
-                    for i, source in enumerate(sources[:5]):
-                        quality = self.get_quality_label(source)
-                        
-                        streams.append({
-                            "title": f"📺 VidFast Enhanced - S{season.zfill(2)}E{episode.zfill(2)} {quality} (Source {i+1})",
-                            "url": source,
-                            "behaviorHints": {
-                                "notWebReady": False,
-                                "bingeGroup": f"vidfast-series-{series_id}",
-                                "countryWhitelist": ["US", "GB", "CA", "AU", "DE", "FR", "IT", "ES", "NL", "BE"]
-                            }
-                        })
-                    
-                    return streams
+                streams.append({
+                    "title": f"📺 VidFast Enhanced - S{season.zfill(2)}E{episode.zfill(2)} {quality} (Source {i+1})",
+                    "url": source,
+                    "behaviorHints": {
+                        "notWebReady": False,
+                        "bingeGroup": f"vidfast-series-{series_id}",
+                        "countryWhitelist": ["US", "GB", "CA", "AU", "DE", "FR", "IT", "ES", "NL", "BE"]
+                    }
+                })
+            
+            return streams
         
         # Fallback
-        fallback_url = f"{self.working_base_url}/tv/{series_id}/{season}/{episode}?autoPlay=true"
+        metrics.inc('fallbacks_total', kind='direct_link')
+        fallback_url = self.episode_player_url(series_id, season, episode)
         return [{
             "title": f"📺 VidFast Enhanced - S{season.zfill(2)}E{episode.zfill(2)} Direct Link",
             "url": fallback_url,
@@ -470,17 +2639,92 @@ class EnhancedVidFastScraper:
                 "bingeGroup": f"vidfast-series-{series_id}"
             }
         }]
+    
+    def scrape_tv_episode(self, series_id, season, episode, deadline=None):
+        """Enhanced TV episode scraping"""
+        return self.scrape_request(('series', series_id, season, episode), deadline)
+    
+    def scrape_plan(self, key):
+        """Return (content type, {template: url} candidates, player URL) for a parsed request"""
+        type, clean_id, season, episode = key
+        if type == 'movie':
+            return type, self.movie_candidates(clean_id), self.movie_player_url(clean_id)
+        return type, self.episode_candidates(clean_id, season, episode), self.episode_player_url(clean_id, season, episode)
+    
+    def wants_browser(self, sources, deadline):
+        """Only when the pages had nothing; a scrape cut short by the deadline has no time left"""
+        return not sources and self.browsers is not None and not deadline.expired()
+    
+    def build_streams(self, key, sources):
+        """The stream list for a parsed request, or its Direct Link fallback"""
+        type, clean_id, season, episode = key
+        if type == 'movie':
+            return self.movie_streams(clean_id, sources)
+        return self.episode_streams(clean_id, season, episode, sources)
+    
+    def scrape_request(self, key, deadline=None):
+        """Scrape a parsed (type, id, season, episode) request: candidate pages, browser fallback, ranking"""
+        deadline = deadline or Deadline()
+        content_type, candidates, player_url = self.scrape_plan(key)
+        with metrics.stage('scrape', content_type=content_type):
+            page_url, sources = self.find_sources(content_type, candidates, deadline)
+        if self.wants_browser(sources, deadline):
+            page_url = player_url
+            sources = self.browser_sources(page_url, deadline)
+        if sources:
+            logger.info(f"Found sources at {content_type} URL: {page_url}")
+            sources = self.rank_sources(sources, deadline)
+        return self.build_streams(key, sources)
 
-# Initialize enhanced scraper
+# Initialize enhanced scraper; mirrors are probed in the background
 scraper = EnhancedVidFastScraper()
+scraper.start()
+stream_cache = StreamCache()
+single_flight = SingleFlight()
 
-@app.route('/')pp.route('/')
-def home():
-    return send_file("landing.html")
+def parse_stream_request(type, id):
+    """Parse a stream request into (type, clean_id, season, episode), or None if invalid"""
+    if type == 'movie':
+        return type, scraper.extract_id(id), None, None
+    if type == 'series':
+        parts = id.split(':')
+        if len(parts) >= 3:
+            return type, scraper.extract_id(parts[0]), parts[1], parts[2]
+        logger.error(f"Invalid series ID format: {id}")
+    return None
+
+def scrape_streams(type, clean_id, season=None, episode=None):
+    """Scrape a parsed request and store the result in the cache"""
+    # One budget for every stage: candidate search, ranking and fallbacks
+    streams = scraper.scrape_request((type, clean_id, season, episode), Deadline())
+    # Store here too so a scrape that outlives its waiters still lands in the cache
+    stream_cache.set((type, clean_id, season, episode), streams)
+    return streams
+
+def load_streams(key):
+    """Scrape a key, joining the call already in flight for it if there is one"""
+    return single_flight.do(key, lambda: scrape_streams(*key))
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='batch')
+prefetcher = EpisodePrefetcher(stream_cache, load_streams)
+prefetcher.load_signals.append(lambda: single_flight.info()['in_flight'])
+
+def resolve_streams(type, clean_id, season=None, episode=None):
+    """Resolve streams for a parsed request through the result cache"""
+    key = (type, clean_id, season, episode)
+    streams = stream_cache.get_or_load(key, lambda: load_streams(key))
+    if type == 'series':
+        # Binge watchers ask for the next episode next
+        prefetcher.schedule(clean_id, season, episode)
+    return streams
 
 @app.route('/')
 def home():
-    """Home route with addon info"""
+    return send_file("landing.html")
+
+@app.route('/info')
+def addon_info():
+    """Addon info route"""
     return jsonify({
         "addon": MANIFEST["name"],
         "version": MANIFEST["version"],
@@ -501,37 +2745,113 @@ def addon_stream(type, id):
     try:
         logger.info(f"Enhanced stream request - Type: {type}, ID: {id}")
         
-        clean_id = scraper.extract_id(id)
-        streams = []
-        
-        if type == 'movie':
-            streams = scraper.scrape_movie(clean_id)
-        elif type == 'series':
-            parts = id.split(':')
-            if len(parts) >= 3:
-                series_id = scraper.extract_id(parts[0])
-                season = parts[1]
-                episode = parts[2]
-                streams = scraper.scrape_tv_episode(series_id, season, episode)
-            else:
-                logger.error(f"Invalid series ID format: {id}")
-                return jsonify({"streams": []})
+        parsed = parse_stream_request(type, id)
+        if parsed is None:
+            return jsonify({"streams": []})
         
+        trace = Trace() if trace_requested(request.args.get(TRACE_PARAM), request.headers.get(TRACE_HEADER)) else None
+        token = current_trace.set(trace)
+        try:
+            with metrics.stage('request', type=type, id=id):
+                streams = resolve_streams(*parsed)
+        finally:
+            current_trace.reset(token)
         logger.info(f"Found {len(streams)} streams for {type} {id}")
+        if trace is not None:
+            return jsonify({"streams": streams, "trace": trace.report()})
         return jsonify({"streams": streams})
         
     except Exception as e:
         logger.error(f"Error in enhanced stream handler: {e}")
         return jsonify({"streams": []})
 
-@app.route('/health')
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+def health_status():
+    """Health report shared by the Flask and ASGI apps"""
+    return {
         "status": "healthy",
         "working_base_url": scraper.working_base_url,
+        "mirrors": scraper.mirrors.info(),
+        "stream_cache": stream_cache.info(),
+        "single_flight": single_flight.info(),
+        "prefetch": prefetcher.info(),
+        "rate_limits": scraper.rate_limiter.info(),
+        "session_pools": {
+            "cloudscraper": scraper.scraper_pool.info(),
+            "requests": scraper.session_pool.info()
+        },
+        "cloudflare_clearance": scraper.clearance.info(),
+        "script_memo": scraper.script_memo.info(),
+        "iframe_pool": scraper.iframe_pool.info(),
+        "browser_pool": scraper.browsers.info() if scraper.browsers is not None else {"enabled": False},
+        "source_verifier": scraper.verifier.info(),
+        "hls_manifests": scraper.manifests.info(),
         "timestamp": time.time()
-    })
+    }
+
+def resolve_batch_item(index, type, id):
+    """Resolve one batch item into its NDJSON record"""
+    record = {"index": index, "type": type, "id": id}
+    parsed = parse_stream_request(type, id)
+    if parsed is None:
+        return dict(record, streams=[], error="invalid id")
+    try:
+        with metrics.stage('request', type=type, id=id):
+            streams = resolve_streams(*parsed)
+    except Exception as e:
+        logger.error(f"Error resolving batch item {type} {id}: {e!r}")
+        return dict(record, streams=[], error=e.__class__.__name__)
+    return dict(record, streams=streams)
+
+@app.route('/batch', methods=['POST'])
+def batch_streams():
+    """Resolve many stream requests at once, one NDJSON line per item as it finishes"""
+    try:
+        items = parse_batch_items(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    logger.info(f"Batch request for {len(items)} items")
+
+    def generate():
+        futures = [submit_traced(batch_executor, resolve_batch_item, index, *item)
+                   for index, item in enumerate(items)]
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result()) + '\n'
+        finally:
+            # Drops the items that have not started if the client went away
+            for future in futures:
+                future.cancel()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/health')
+def health_check():
+    """Health check endpoint"""
+    return jsonify(health_status())
+
+def cache_samples():
+    """Cache and coalescing counters from the component stats, as metric samples"""
+    stream = stream_cache.info()
+    memo = scraper.script_memo.info()
+    manifests = scraper.manifests.info()
+    verifier = scraper.verifier.info()
+    counts = {
+        'stream': (stream['hits'] + stream['stale_hits'], stream['misses']),
+        'script_memo': (memo['hits'], memo['misses']),
+        'hls_manifest': (manifests['hits'], manifests['fetches']),
+        'source_verify': (verifier['hits'], verifier['probes'])
+    }
+    samples = [('coalesced_calls_total', {}, single_flight.info()['coalesced'])]
+    for cache, (hits, misses) in counts.items():
+        samples.append(('cache_hits_total', {'cache': cache}, hits))
+        samples.append(('cache_misses_total', {'cache': cache}, misses))
+        samples.append(('cache_hit_ratio', {'cache': cache}, round(hits / (hits + misses), 4) if hits + misses else 0))
+    return samples
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return Response(metrics.render(cache_samples()), mimetype='text/plain; version=0.0.4')
 
 @app.errorhandler(404)
 def not_found(error):
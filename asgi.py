@@ -0,0 +1,541 @@
+"""ASGI app backed by an asyncio scraping engine.
+
+Serves the same /manifest.json, /stream/<type>/<id>.json, /batch and /health
+routes as the Flask app, but upstream fetches are non-blocking, so hundreds of
+slow lookups can be open at once without a thread per request:
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+
+Page parsing, template ordering, mirror selection, rate limits, Cloudflare
+clearance and the result cache are shared with the synchronous scraper in
+app.py. Stored clearance is replayed on the async client; a page that answers
+with a Cloudflare challenge is fetched again through the synchronous
+scraper's cloudscraper sessions in a worker thread, which solves it.
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from app import (
+    MANIFEST, BATCH_CONCURRENCY, COALESCE_TIMEOUT, TRACE_HEADER, TRACE_PARAM, HLS_MAX_PLAYLIST_BYTES,
+    MIN_FETCH_TIMEOUT, PROBE_CONCURRENCY, PROBE_MODE, STREAM_CHUNK_SIZE, STREAM_EARLY_EXIT, Deadline, EarlyExitScanner, EpisodePrefetcher, IframeCrawl, Trace,
+    cache_samples, current_trace, get_random_headers, health_status, logger, metrics,
+    parse_batch_items, parse_master_playlist, parse_stream_request, scraper, stream_cache, trace_requested
+)
+
+# Async engine settings
+ASYNC_CONCURRENCY = int(os.environ.get('ASYNC_CONCURRENCY', 200))  # upstream fetches in flight
+ASYNC_KEEPALIVE = int(os.environ.get('ASYNC_KEEPALIVE', 50))
+
+class ChallengeRequired(Exception):
+    """A Cloudflare challenge the async client cannot solve on its own"""
+
+def is_challenge(response):
+    return response.status_code in (403, 503) and (
+        'cf-mitigated' in response.headers or 'cloudflare' in response.headers.get('server', '').lower()
+    )
+
+class AsyncVidFastScraper:
+    """Asyncio counterpart of EnhancedVidFastScraper's fetch and crawl path"""
+
+    def __init__(self, scraper, concurrency=ASYNC_CONCURRENCY):
+        self.scraper = scraper
+        self.concurrency = concurrency
+        self.client = None
+        self.semaphore = None
+        self.batch_semaphore = None
+        self.loop = None
+        self.inflight = {}
+        self.stats = {'fetches': 0, 'fetch_errors': 0, 'challenges': 0, 'calls': 0, 'coalesced': 0, 'timeouts': 0}
+
+    async def start(self):
+        """Create the HTTP client; safe to call more than once"""
+        if self.client is None:
+            self.loop = asyncio.get_running_loop()
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+            self.client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=ASYNC_KEEPALIVE)
+            )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get_page_content(self, url, deadline):
+        """Fetch page content without blocking the event loop"""
+        wait_budget = deadline.remaining() - MIN_FETCH_TIMEOUT
+        if wait_budget < 0:
+            logger.warning(f"Deadline reached, skipping fetch of {url}")
+            return None
+
+        wait = self.scraper.rate_limiter.reserve(url, wait_budget)
+        if wait is None:
+            logger.warning(f"Rate limit wait would overrun the deadline, skipping fetch of {url}")
+            return None
+        if wait > 0:
+            with metrics.stage('rate_limit_wait', host=urlparse(url).netloc):
+                await asyncio.sleep(wait)
+
+        headers = get_random_headers()
+        clearance = self.scraper.clearance.get(urlparse(url).netloc.lower())
+        if clearance:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in clearance['cookies'].items())
+            if clearance['user_agent']:
+                headers['User-Agent'] = clearance['user_agent']
+
+        self.stats['fetches'] += 1
+        try:
+            return await asyncio.wait_for(self._get(url, headers, deadline), deadline.remaining())
+        except ChallengeRequired:
+            self.stats['challenges'] += 1
+            metrics.inc('fallbacks_total', kind='cloudscraper')
+            metrics.event('fallback', kind='cloudscraper', url=url)
+            logger.info(f"Cloudflare challenge at {url}, retrying through cloudscraper")
+            return await asyncio.to_thread(self.scraper.get_page_content, url, deadline=deadline)
+        except Exception as e:
+            self.stats['fetch_errors'] += 1
+            if not isinstance(e, httpx.HTTPStatusError):
+                metrics.inc('upstream_responses_total', kind='page',
+                            status='timeout' if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)) else 'error')
+            logger.error(f"Failed to fetch {url}: {e!r}")
+            if not isinstance(e, httpx.HTTPStatusError):
+                self.scraper.mirrors.report(url, ok=False)
+            return None
+
+    async def _get(self, url, headers, deadline):
+        async with self.semaphore:
+            started = time.monotonic()
+            async with self.client.stream('GET', url, headers=headers, timeout=deadline.timeout(15)) as response:
+                metrics.record_stage('page_fetch', started, url=url)
+                metrics.inc('upstream_responses_total', kind='page', status=response.status_code)
+                # A challenge is not the host pushing back; the cloudscraper retry reports its own response
+                if is_challenge(response):
+                    raise ChallengeRequired(url)
+                self.scraper.rate_limiter.on_response(url, response.status_code, response.headers.get('Retry-After'))
+                # A 4xx from a mirror means a wrong path, not a mirror that is down
+                self.scraper.mirrors.report(url, ok=response.status_code < 500)
+                response.raise_for_status()
+                with metrics.stage('page_read', url=url):
+                    if not STREAM_EARLY_EXIT:
+                        await response.aread()
+                        return response.text
+
+                    # Scan as the body arrives and hang up once enough sources are in
+                    scanner = EarlyExitScanner(self.scraper, response.encoding)
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        if scanner.feed(chunk):
+                            logger.info(f"Enough sources after {scanner.bytes_read} bytes, closing {url} early")
+                            break
+                    return scanner.text()
+
+    async def extract_video_sources(self, html_content, page_url, deadline, crawl, depth=0):
+        """Extract a page's sources, then crawl its iframes concurrently"""
+        # Parsing is CPU-bound, so keep it off the event loop
+        page_sources, iframe_urls = await asyncio.to_thread(
+            self.scraper.extract_page_sources, html_content, page_url
+        )
+        crawl.record(page_sources, self.scraper.get_quality_score)
+        deadline.record(page_sources)
+
+        sources = list(page_sources)
+        iframe_urls = self.scraper.claim_iframes(iframe_urls, crawl, depth)
+        if iframe_urls:
+            sources.extend(await self.crawl_iframes(iframe_urls, deadline, crawl, depth + 1))
+
+        return self.scraper.sort_sources_by_quality(self.scraper.clean_sources(sources, page_url))
+
+    async def scrape_iframe_sources(self, iframe_url, deadline, crawl, depth):
+        metrics.observe('iframe_depth', depth)
+        try:
+            logger.info(f"Scraping iframe: {iframe_url}")
+            with metrics.stage('iframe', url=iframe_url, depth=depth):
+                content = await self.get_page_content(iframe_url, deadline)
+                if content:
+                    return await self.extract_video_sources(content, iframe_url, deadline, crawl, depth)
+        except Exception as e:
+            logger.error(f"Failed to scrape iframe {iframe_url}: {e}")
+
+        return []
+
+    async def crawl_iframes(self, iframe_urls, deadline, crawl, depth):
+        """Scrape sibling iframes concurrently until enough sources are found"""
+        sources = []
+        if crawl.enough() or deadline.expired():
+            return sources
+
+        running = {
+            asyncio.ensure_future(self.scrape_iframe_sources(iframe_url, deadline, crawl, depth))
+            for iframe_url in iframe_urls
+        }
+        try:
+            # Same bounds as the sync crawl: a short grace period once the
+            # crawl has enough, otherwise up to the deadline
+            while running:
+                timeout = crawl.wait_timeout(deadline)
+                if timeout == 0:
+                    break
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    sources.extend(task.result())
+        finally:
+            for task in running:
+                if task.done() and not task.cancelled():
+                    sources.extend(task.result())
+                else:
+                    task.cancel()
+
+        return sources
+
+    async def probe_candidate_urls(self, candidate_urls, deadline, on_result, crawl):
+        """Async version of EnhancedVidFastScraper.probe_candidate_urls"""
+        for page_url in candidate_urls:
+            crawl.claim(page_url)
+
+        async def probe(page_url):
+            started = time.monotonic()
+            with metrics.stage('candidate', url=page_url):
+                content = await self.get_page_content(page_url, deadline)
+                sources = await self.extract_video_sources(content, page_url, deadline, crawl) if content else []
+            if not deadline.expired():
+                on_result(page_url, bool(sources), time.monotonic() - started)
+            return page_url, sources
+
+        if PROBE_CONCURRENCY <= 1:
+            for page_url in candidate_urls:
+                if deadline.expired():
+                    break
+                page_url, sources = await probe(page_url)
+                if sources:
+                    return page_url, sources
+            return self.scraper.partial_result(deadline)
+
+        tasks = [asyncio.ensure_future(probe(page_url)) for page_url in candidate_urls]
+        results = {}
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=deadline.remaining()):
+                try:
+                    page_url, sources = await next_done
+                except Exception as e:
+                    logger.error(f"Probe failed: {e}")
+                    continue
+
+                if sources:
+                    if PROBE_MODE != 'best':
+                        return page_url, sources
+                    results[page_url] = sources
+        except asyncio.TimeoutError:
+            logger.warning("Deadline reached while probing candidate URLs")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return self.scraper.best_candidate(candidate_urls, results, deadline)
+
+    async def find_sources(self, content_type, candidates, deadline=None):
+        """Async version of EnhancedVidFastScraper.find_sources"""
+        deadline = deadline or Deadline()
+        crawl = IframeCrawl()
+        waves, on_result = self.scraper.candidate_waves(content_type, candidates)
+        for wave in waves:
+            page_url, sources = await self.probe_candidate_urls(wave, deadline, on_result, crawl)
+            if sources or deadline.expired():
+                return page_url, sources
+
+        return None, []
+
+    async def probe_source(self, url, timeout):
+        """Async version of EnhancedVidFastScraper.probe_source"""
+        headers = get_random_headers()
+        headers['Range'] = 'bytes=0-0'
+        async with self.semaphore:
+            started = time.monotonic()
+            try:
+                async with self.client.stream('GET', url, headers=headers, timeout=timeout) as response:
+                    alive = self.scraper.verifier.classify(response.status_code)
+                metrics.inc('upstream_responses_total', kind='verify', status=response.status_code)
+                self.scraper.verifier.set(url, alive, time.monotonic() - started)
+            except httpx.TimeoutException:
+                metrics.inc('upstream_responses_total', kind='verify', status='timeout')
+                logger.info(f"Source probe timed out: {url}")
+                self.scraper.verifier.set(url, None, None)
+            except Exception as e:
+                metrics.inc('upstream_responses_total', kind='verify', status='error')
+                logger.info(f"Source probe failed for {url}: {e!r}")
+                self.scraper.verifier.set(url, False, None)
+
+    async def run_probes(self, probe, urls, budget, name):
+        """Async version of EnhancedVidFastScraper.run_probes"""
+        tasks = {asyncio.ensure_future(probe(url, budget)): url for url in urls}
+        _, not_done = await asyncio.wait(tasks, timeout=budget)
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.warning(f"{len(not_done)} {name} probes unfinished within {budget:.1f}s")
+        return [tasks[task] for task in not_done]
+
+    async def verify_sources(self, sources, deadline=None):
+        """Async version of EnhancedVidFastScraper.verify_sources"""
+        pending, budget = self.scraper.verify_pending(sources, deadline)
+        unfinished = await self.run_probes(self.probe_source, pending, budget, 'verify') if pending else []
+        return self.scraper.verify_ranked(sources, unfinished)
+
+    async def fetch_playlist(self, url, timeout):
+        """Async version of EnhancedVidFastScraper.fetch_playlist"""
+        async with self.semaphore:
+            started = time.monotonic()
+            try:
+                async with self.client.stream('GET', url, headers=get_random_headers(), timeout=timeout) as response:
+                    metrics.inc('upstream_responses_total', kind='playlist', status=response.status_code)
+                    self.scraper.verifier.set(
+                        url, self.scraper.verifier.classify(response.status_code), time.monotonic() - started
+                    )
+                    response.raise_for_status()
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        body.extend(chunk)
+                        if len(body) >= HLS_MAX_PLAYLIST_BYTES:
+                            break
+            except Exception as e:
+                if not isinstance(e, httpx.HTTPStatusError):
+                    metrics.inc('upstream_responses_total', kind='playlist',
+                                status='timeout' if isinstance(e, httpx.TimeoutException) else 'error')
+                logger.info(f"Playlist fetch failed for {url}: {e!r}")
+                self.scraper.manifests.set(url, None)
+                return
+
+        self.scraper.manifests.set(url, parse_master_playlist(body.decode('utf-8', errors='replace')))
+
+    async def inspect_playlists(self, sources, deadline=None):
+        """Async version of EnhancedVidFastScraper.inspect_playlists"""
+        pending, budget = self.scraper.playlist_pending(sources, deadline)
+        unfinished = await self.run_probes(self.fetch_playlist, pending, budget, 'playlist') if pending else []
+        return self.scraper.playlists_ranked(sources, unfinished)
+
+    async def rank_sources(self, sources, deadline=None):
+        """Async version of EnhancedVidFastScraper.rank_sources"""
+        for stage, method in self.scraper.ranking_stages():
+            with metrics.stage(stage):
+                sources = await getattr(self, method)(sources, deadline)
+        return sources
+
+    async def scrape_request(self, key, deadline=None):
+        """Async version of EnhancedVidFastScraper.scrape_request"""
+        deadline = deadline or Deadline()
+        content_type, candidates, player_url = self.scraper.scrape_plan(key)
+        with metrics.stage('scrape', content_type=content_type):
+            page_url, sources = await self.find_sources(content_type, candidates, deadline)
+        if self.scraper.wants_browser(sources, deadline):
+            # Selenium blocks, so the pooled browser is driven from a worker thread
+            page_url = player_url
+            sources = await asyncio.to_thread(self.scraper.browser_sources, page_url, deadline)
+        if sources:
+            logger.info(f"Found sources at {content_type} URL: {page_url}")
+            sources = await self.rank_sources(sources, deadline)
+        return self.scraper.build_streams(key, sources)
+
+    def coalesce(self, key, factory):
+        """Return the in-flight task for key, starting one if there is none"""
+        self.stats['calls'] += 1
+        task = self.inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            metrics.event('coalesced')
+            return task
+
+        task = asyncio.ensure_future(factory())
+        self.inflight[key] = task
+        task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return task
+
+    async def scrape(self, key):
+        """Scrape a parsed request and store the result in the cache"""
+        # One budget for every stage: candidate search, ranking and fallbacks
+        streams = await self.scrape_request(key, Deadline())
+        stream_cache.set(key, streams)
+        return streams
+
+    def load(self, key):
+        """Return the in-flight scrape task for key"""
+        return self.coalesce(key, lambda: self.scrape(key))
+
+    def load_blocking(self, key):
+        """Run a scrape on the engine's loop from another thread and wait for it"""
+        return asyncio.run_coroutine_threadsafe(self.await_task(key), self.loop).result()
+
+    async def await_task(self, key):
+        return await self.load(key)
+
+    async def resolve_streams(self, type, clean_id, season=None, episode=None):
+        """Resolve streams through the shared result cache with coalescing"""
+        await self.start()
+        key = (type, clean_id, season, episode)
+
+        streams, is_stale = stream_cache.get(key)
+        metrics.event('stream_cache', result='miss' if streams is None else 'stale' if is_stale else 'hit')
+        if streams is None:
+            try:
+                # Shielded so a timed-out waiter does not cancel the shared scrape
+                streams = await asyncio.wait_for(asyncio.shield(self.load(key)), COALESCE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                logger.warning(f"Timed out waiting for in-flight call {key}")
+                raise
+        elif is_stale:
+            self.load(key)
+
+        if type == 'series':
+            # Binge watchers ask for the next episode next
+            prefetcher.schedule(clean_id, season, episode)
+        return streams
+
+    async def resolve_batch_item(self, index, type, id):
+        """Async version of resolve_batch_item in app.py"""
+        record = {"index": index, "type": type, "id": id}
+        parsed = parse_stream_request(type, id)
+        if parsed is None:
+            return dict(record, streams=[], error="invalid id")
+        try:
+            async with self.batch_semaphore:
+                with metrics.stage('request', type=type, id=id):
+                    streams = await self.resolve_streams(*parsed)
+        except Exception as e:
+            logger.error(f"Error resolving batch item {type} {id}: {e!r}")
+            return dict(record, streams=[], error=e.__class__.__name__)
+        return dict(record, streams=streams)
+
+    async def resolve_batch(self, items):
+        """Yield batch records in the order they finish"""
+        await self.start()
+        tasks = [asyncio.ensure_future(self.resolve_batch_item(index, *item)) for index, item in enumerate(items)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Shared scrapes are shielded, so this only drops the waiters
+            for task in tasks:
+                task.cancel()
+
+    def info(self):
+        return dict(self.stats, in_flight=len(self.inflight), concurrency=self.concurrency)
+
+engine = AsyncVidFastScraper(scraper)
+# Prefetch workers are threads that hand their scrapes to the engine's loop
+prefetcher = EpisodePrefetcher(stream_cache, engine.load_blocking)
+prefetcher.load_signals.append(lambda: len(engine.inflight))
+
+async def send_body(send, body, content_type, status=200):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*'),
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, payload, status=200):
+    await send_body(send, json.dumps(payload).encode(), b'application/json', status)
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def send_ndjson(send, records):
+    """Send each record as one JSON line as soon as it is available"""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'application/x-ndjson'),
+            (b'access-control-allow-origin', b'*'),
+        ]
+    })
+    async for record in records:
+        await send({'type': 'http.response.body', 'body': json.dumps(record).encode() + b'\n', 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await engine.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def stream_handler(type, id, trace=None):
+    """Enhanced stream handler with better error handling"""
+    try:
+        logger.info(f"Async stream request - Type: {type}, ID: {id}")
+
+        parsed = parse_stream_request(type, id)
+        if parsed is None:
+            return {"streams": []}
+
+        # Tasks started below copy this context, so the trace follows them
+        current_trace.set(trace)
+        with metrics.stage('request', type=type, id=id):
+            streams = await engine.resolve_streams(*parsed)
+        logger.info(f"Found {len(streams)} streams for {type} {id}")
+        if trace is not None:
+            return {"streams": streams, "trace": trace.report()}
+        return {"streams": streams}
+    except Exception as e:
+        logger.error(f"Error in async stream handler: {e!r}")
+        return {"streams": []}
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    if path == '/manifest.json':
+        await send_json(send, MANIFEST)
+    elif path == '/health':
+        await send_json(send, dict(health_status(), async_engine=engine.info(), prefetch=prefetcher.info()))
+    elif path == '/metrics':
+        body = metrics.render(cache_samples()).encode()
+        await send_body(send, body, b'text/plain; version=0.0.4')
+    elif path == '/batch':
+        if scope['method'] != 'POST':
+            await send_json(send, {"error": "Method not allowed"}, 405)
+            return
+        try:
+            items = parse_batch_items(json.loads(await read_body(receive) or b'null'))
+        except ValueError as e:
+            await send_json(send, {"error": str(e)}, 400)
+            return
+        logger.info(f"Async batch request for {len(items)} items")
+        await send_ndjson(send, engine.resolve_batch(items))
+    elif path.startswith('/stream/') and path.endswith('.json'):
+        route = path[len('/stream/'):-len('.json')].split('/', 1)
+        if len(route) != 2 or not route[1]:
+            await send_json(send, {"error": "Not found"}, 404)
+            return
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        trace = Trace() if trace_requested(
+            query.get(TRACE_PARAM, [None])[-1], headers.get(TRACE_HEADER.lower())
+        ) else None
+        await send_json(send, await stream_handler(*route, trace=trace))
+    else:
+        await send_json(send, {"error": "Not found"}, 404)
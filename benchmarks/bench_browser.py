@@ -0,0 +1,108 @@
+"""Benchmark: headless-browser fallback against a JavaScript-only player page.
+
+Run from the repository root (needs selenium, chromium and chromedriver):
+
+    python benchmarks/bench_browser.py [--pages 20] [--pool-size 2] [--latency-ms 40]
+                                       [--output results.json]
+
+The corpus stand-in serves /jsplayer/<id>, a player that builds its HLS
+playlist URL in JavaScript, so static extraction finds nothing there. The
+page is loaded through app.BrowserPool: once on a cold pool, which pays for
+the browser launch, then repeatedly on the warm pool with as many pages open
+at once as there are browsers. BROWSER_BINARY and CHROMEDRIVER_PATH are
+honoured as in the app.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_load import BENCH_ENV, summarize  # noqa: E402
+from standin import StandIn  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=20, help='page loads on the warm pool')
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--page-timeout', type=float, default=15)
+    parser.add_argument('--latency-ms', type=float, default=40, help='stand-in response latency')
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='keep the app log output')
+    args = parser.parse_args()
+
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+    import app
+    if not args.verbose:
+        logging.getLogger(app.__name__).setLevel(logging.CRITICAL)
+    if app.webdriver is None:
+        print("selenium is not installed", file=sys.stderr)
+        return 1
+
+    standin = StandIn(args.latency_ms, args.jitter_ms)
+    base_url = standin.start()
+    pool = app.BrowserPool(size=args.pool_size)
+
+    def capture(n):
+        url = f"{base_url}/jsplayer/tt{3000000 + n}"
+        started = time.perf_counter()
+        try:
+            media = pool.capture(url, args.page_timeout)
+        except Exception as e:
+            return {'ms': (time.perf_counter() - started) * 1000, 'media': [], 'error': repr(e)}
+        return {'ms': (time.perf_counter() - started) * 1000, 'media': media}
+
+    try:
+        body, _ = standin.lookup('/jsplayer/tt3000000')
+        static_sources, _ = app.scraper.extract_page_sources(body.decode('utf-8'), base_url + '/jsplayer/tt3000000')
+        cold = capture(0)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.pool_size) as executor:
+            warm = list(executor.map(capture, range(1, args.pages + 1)))
+        wall = time.perf_counter() - started
+    finally:
+        pool.close()
+        standin.stop()
+
+    found = [result for result in warm if any('.m3u8' in url for url in result['media'])]
+    report = {
+        'benchmark': 'bench_browser',
+        'timestamp': time.time(),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'verbose')},
+        'static_sources': len(static_sources),
+        'cold': {'ms': round(cold['ms'], 1), 'media': cold['media'], 'error': cold.get('error')},
+        'warm': {
+            'pages': len(warm),
+            'found_rate': round(len(found) / len(warm), 4) if warm else None,
+            'pages_per_second': round(len(warm) / wall, 2),
+            'latency_ms': summarize([result['ms'] for result in warm]),
+            'errors': sorted({result['error'] for result in warm if 'error' in result}),
+        },
+        'pool': pool.info(),
+        'standin': dict(standin.stats),
+    }
+
+    print(f"static extraction: {report['static_sources']} sources; cold page {report['cold']['ms']:.0f} ms", file=sys.stderr)
+    if warm:
+        print(f"warm pool: {report['warm']['pages_per_second']} pages/s, "
+              f"p50 {report['warm']['latency_ms']['p50']:.0f} ms, found rate {report['warm']['found_rate']:.0%}",
+              file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
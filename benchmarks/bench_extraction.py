@@ -0,0 +1,151 @@
+"""Micro-benchmark: single-pass source scanner vs the former per-pattern scan.
+
+Run from the repository root:
+
+    python benchmarks/bench_extraction.py [--repeat N]
+
+Checks that both implementations find the same sources on a set of synthetic
+player pages, then reports the time per page for each.
+"""
+import argparse
+import base64
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Offline: never probe the real mirrors
+os.environ.setdefault('MIRROR_MONITOR', '0')
+
+from app import scraper  # noqa: E402
+
+# The pattern list extract_video_sources used before the combined scanner
+LEGACY_VIDEO_PATTERNS = [
+    r'<video[^>]*src=["\']([^"\']+)["\']',
+    r'<source[^>]*src=["\']([^"\']+)["\']',
+    r'src\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
+    r'file\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
+    r'video\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
+    r'url\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
+    r'link\s*:\s*["\']([^"\']+\.(?:m3u8|mp4|webm|avi|mkv|mov|flv|ts))["\']',
+    r'["\']([^"\']+\.m3u8(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']+\.mpd(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']+\.mp4(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']+\.webm(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']+\.avi(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']+\.mkv(?:\?[^"\']*)?)["\']',
+    r'["\']([^"\']*(?:stream|video|play|embed|player)[^"\']*\.(?:m3u8|mp4|webm|ts)(?:\?[^"\']*)?)["\']',
+    r'atob\s*\(\s*["\']([^"\']+)["\']',
+    r'playlist\s*:\s*["\']([^"\']+)["\']',
+    r'manifest\s*:\s*["\']([^"\']+)["\']',
+]
+
+
+def legacy_scan(html_content):
+    sources = []
+    for pattern in LEGACY_VIDEO_PATTERNS:
+        for match in re.findall(pattern, html_content, re.IGNORECASE | re.DOTALL):
+            if pattern.startswith('atob'):
+                try:
+                    decoded = base64.b64decode(match).decode('utf-8')
+                    if scraper.is_valid_video_url(decoded):
+                        sources.append(decoded)
+                except Exception:
+                    continue
+            elif scraper.is_valid_video_url(match):
+                sources.append(match)
+    return set(sources)
+
+
+def single_pass_scan(html_content):
+    sources = []
+    for kind, match in scraper.scan_video_sources(html_content):
+        if kind == 'atob':
+            try:
+                decoded = base64.b64decode(match).decode('utf-8')
+                if scraper.is_valid_video_url(decoded):
+                    sources.append(decoded)
+            except Exception:
+                continue
+        elif scraper.is_valid_video_url(match):
+            sources.append(match)
+    return set(sources)
+
+
+# Hand-written snippets that exercise overlaps between the old patterns
+EDGE_CASES = [
+    '<VIDEO class="https://a.example/poster/clip.mp4" SRC="https://a.example/media/main.m3u8">',
+    '<source src=\'https://b.example/hls/index.m3u8?sig=1&exp=2\' type="application/x-mpegURL">',
+    "FILE :\n   'https://c.example/stream/seg.ts'",
+    'src: "https://d.example/movie.flv", url:"https://d.example/video/alt.mov"',
+    'var u = "https://e.example/player/live.ts?token=abc";',
+    'playlist : "https://f.example/watch/list" , manifest:"https://f.example/dash/manifest"',
+    'atob( "' + base64.b64encode(b'https://g.example/video/clip.webm').decode() + '" )',
+    '"https://h.example/a.mp4.txt" "https://h.example/b.mkv?x=.mp4"',
+]
+
+
+def make_page(rng, filler_blocks):
+    """Build a player-like page with sources scattered through filler markup"""
+    cdn = f"https://cdn{rng.randint(1, 9)}.example.net"
+    snippets = [
+        f'<video id="player" class="vjs" src="{cdn}/media/{rng.randint(1, 999)}/720p.mp4"></video>',
+        f'<source type="application/x-mpegURL" src="{cdn}/hls/{rng.randint(1, 999)}/master.m3u8?token=abc">',
+        f"jwplayer('p').setup({{file: '{cdn}/stream/{rng.randint(1, 999)}/index.m3u8', image: '/poster.jpg'}});",
+        f'var cfg = {{playlist: "{cdn}/playlist/{rng.randint(1, 999)}/hls", link: "{cdn}/dl/movie.mkv"}};',
+        f'var m = {{manifest: "{cdn}/dash/{rng.randint(1, 999)}/manifest.mpd"}};',
+        f'var s = atob("{base64.b64encode(f"{cdn}/video/{rng.randint(1, 999)}/1080p.mp4".encode()).decode()}");',
+        f'<a href="{cdn}/watch/player/episode.webm">mirror</a>',
+        '<iframe src="https://vidsrc.example/embed/movie/tt0111161"></iframe>',
+    ]
+    filler = [
+        '<div class="row"><span class="title">Lorem ipsum dolor sit amet</span>'
+        '<img src="/static/img/thumb.jpg" alt="thumb"><a href="/title/tt0111161">Details</a></div>',
+        '<script src="/static/js/app.bundle.js"></script><link rel="stylesheet" href="/static/css/site.css">',
+        '<script>window.__DATA__ = {"user": null, "items": [1, 2, 3], "theme": "dark", "lang": "en"};</script>',
+    ]
+    parts = []
+    for _ in range(filler_blocks):
+        parts.append(rng.choice(filler))
+        if rng.random() < 0.05:
+            parts.append(rng.choice(snippets))
+    parts.extend(snippets)
+    rng.shuffle(parts)
+    return '<html><head><title>Player</title></head><body>' + '\n'.join(parts) + '</body></html>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [(size, make_page(rng, size)) for size in (50, 500, 5000) for _ in range(3)]
+    corpus += [(0, snippet) for snippet in EDGE_CASES]
+
+    mismatches = 0
+    for size, page in corpus:
+        legacy, single = legacy_scan(page), single_pass_scan(page)
+        if legacy != single:
+            mismatches += 1
+            print(f"MISMATCH ({size} blocks): legacy-only={legacy - single} single-only={single - legacy}")
+    print(f"equivalence: {len(corpus) - mismatches}/{len(corpus)} pages identical")
+
+    print(f"{'blocks':>8} {'bytes':>10} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}")
+    for size in sorted({size for size, _ in corpus if size}):
+        pages = [page for s, page in corpus if s == size]
+        legacy_t = timeit.timeit(lambda: [legacy_scan(p) for p in pages], number=args.repeat)
+        single_t = timeit.timeit(lambda: [single_pass_scan(p) for p in pages], number=args.repeat)
+        per_page = args.repeat * len(pages)
+        print(f"{size:>8} {sum(map(len, pages)) // len(pages):>10} "
+              f"{legacy_t / per_page * 1000:>10.3f} {single_t / per_page * 1000:>10.3f} "
+              f"{legacy_t / single_t:>7.1f}x")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Load test: extraction throughput, addon_stream latency under load and memory per request.
+
+Run from the repository root:
+
+    python benchmarks/bench_load.py [--concurrency 16] [--requests 200] [--latency-ms 40]
+                                    [--error-rate 0.02] [--unpaced] [--output results.json]
+
+The vidfast mirrors are replaced by the corpus stand-in (standin.py), so the
+whole scrape path runs offline: candidate templates, nested iframes,
+obfuscated and atob sources, HLS playlist introspection and fallbacks on
+injected errors. Every stream request uses a fresh title id, so the numbers
+are for uncached scrapes. --unpaced lifts the per-host rate limiter to
+separate its cost from the rest of the pipeline. Results are written as JSON
+for regression tracking; a short summary goes to stderr.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin import StandIn  # noqa: E402
+
+# Nothing is persisted between runs and the real mirrors are never probed.
+# The per-host rate limiter keeps its defaults: one host serves everything
+# here, as a single mirror does in production, so the limiter's ramp-up is
+# part of what gets measured
+BENCH_ENV = {
+    'MIRROR_MONITOR': '0',
+    'TEMPLATE_INDEX_PATH': '',
+    'CLEARANCE_STORE_PATH': '',
+}
+
+# Corpus pages for the extraction pass, as the stand-in serves them
+EXTRACTION_PAGES = [
+    '/movie/tt0111161',
+    '/tv/tt0903747/1/1',
+    '/embed/movie/tt0111161',
+    '/player/a/tt0111161',
+    '/player/b/tt0111161',
+]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(percentile(values, 50), 3),
+        'p90': round(percentile(values, 90), 3),
+        'p99': round(percentile(values, 99), 3),
+        'max': round(max(values), 3),
+    }
+
+
+def stream_paths(count, series_ratio, offset):
+    """Stremio stream paths with title ids nobody has asked for yet"""
+    paths = []
+    for i in range(count):
+        n = offset + i
+        if series_ratio and i % round(1 / series_ratio) == 0:
+            paths.append(f"/stream/series/tt{2000000 + n}:1:{n % 10 + 1}.json")
+        else:
+            paths.append(f"/stream/movie/tt{1000000 + n}.json")
+    return paths
+
+
+def bench_extraction(app, standin, base_url, repeat):
+    """Time extract_page_sources per corpus page, with the script memo cold and warm"""
+    scraper = app.scraper
+    pages = {}
+    total_bytes = cold_total = 0.0
+    for path in EXTRACTION_PAGES:
+        body, _ = standin.lookup(path)
+        html = body.decode('utf-8')
+        page_url = base_url + path
+
+        cold = []
+        for _ in range(repeat):
+            scraper.script_memo.entries.clear()
+            started = time.perf_counter()
+            sources, iframes = scraper.extract_page_sources(html, page_url)
+            cold.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            scraper.extract_page_sources(html, page_url)
+        warm = (time.perf_counter() - started) / repeat
+
+        cold_mean = sum(cold) / len(cold)
+        total_bytes += len(body)
+        cold_total += cold_mean
+        pages[path] = {
+            'bytes': len(body),
+            'sources': len(sources),
+            'iframes': len(iframes),
+            'cold_ms': round(cold_mean * 1000, 4),
+            'warm_ms': round(warm * 1000, 4),
+        }
+
+    return {
+        'repeat': repeat,
+        'pages': pages,
+        'pages_per_second': round(len(pages) / cold_total, 1),
+        'mb_per_second': round(total_bytes / cold_total / 1e6, 2),
+    }
+
+
+def stage_summary(metrics):
+    """Count and mean milliseconds per stage from the app's metrics registry"""
+    with metrics.lock:
+        values = dict(metrics.values)
+    stages = {}
+    for (name, labels), value in values.items():
+        if name == 'stage_seconds':
+            _, total, count = value
+            stages[dict(labels)['stage']] = {'count': count, 'mean_ms': round(total / count * 1000, 2)}
+    return dict(sorted(stages.items()))
+
+
+def bench_load(app, paths, concurrency):
+    """Fire stream requests at addon_stream from concurrent clients"""
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def request(path):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.app.test_client()
+        started = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - started
+        streams = response.get_json().get('streams', []) if response.status_code == 200 else []
+        with lock:
+            results.append({
+                'ms': elapsed * 1000,
+                'status': response.status_code,
+                'streams': len(streams),
+                'fallback': app.stream_cache.is_negative(streams),
+            })
+
+    with app.metrics.lock:
+        app.metrics.values.clear()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(request, paths))
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': len(results),
+        'concurrency': concurrency,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(results) / wall, 2),
+        'latency_ms': summarize([result['ms'] for result in results]),
+        'errors': sum(1 for result in results if result['status'] != 200),
+        'fallback_rate': round(sum(result['fallback'] for result in results) / len(results), 4),
+        'streams_per_request': round(sum(result['streams'] for result in results) / len(results), 2),
+        'stages': stage_summary(app.metrics),
+    }
+
+
+def bench_memory(app, paths):
+    """Peak Python heap allocated while serving each request, one at a time"""
+    client = app.app.test_client()
+    peaks = []
+    tracemalloc.start()
+    try:
+        for path in paths:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            client.get(path)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+    return {'requests': len(paths), 'peak_kb': summarize(peaks)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='stream requests in the load phase')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--series-ratio', type=float, default=0.25, help='share of series episode requests')
+    parser.add_argument('--latency-ms', type=float, default=40, help='stand-in response latency')
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.02, help='share of errors and dropped connections')
+    parser.add_argument('--error-status', type=int, default=502, help='429/503 also trigger host backoff')
+    parser.add_argument('--extract-repeat', type=int, default=50)
+    parser.add_argument('--memory-requests', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--unpaced', action='store_true', help='lift the per-host rate limiter')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='keep the app log output')
+    args = parser.parse_args()
+
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+    if args.unpaced:
+        os.environ.update(RATE_LIMIT_RATE='100000', RATE_LIMIT_BURST='100000')
+    import app
+    if not args.verbose:
+        logging.getLogger(app.__name__).setLevel(logging.CRITICAL)
+
+    standin = StandIn(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed)
+    base_url = standin.start()
+    app.scraper.mirrors = app.MirrorMonitor([base_url], app.scraper.probe_mirror, interval=0)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = {
+        'benchmark': 'bench_load',
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'verbose')},
+        'extraction': bench_extraction(app, standin, base_url, args.extract_repeat),
+        'load': bench_load(app, stream_paths(args.requests, args.series_ratio, 0), args.concurrency),
+        'memory': bench_memory(app, stream_paths(args.memory_requests, args.series_ratio, args.requests)),
+    }
+    report['memory']['rss_growth_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    report['standin'] = dict(standin.stats)
+    standin.stop()
+
+    load, memory = report['load'], report['memory']
+    print(f"extraction: {report['extraction']['pages_per_second']} pages/s, "
+          f"{report['extraction']['mb_per_second']} MB/s", file=sys.stderr)
+    print(f"addon_stream: {load['throughput_rps']} req/s at concurrency {load['concurrency']}, "
+          f"p50 {load['latency_ms']['p50']:.0f} ms, p99 {load['latency_ms']['p99']:.0f} ms, "
+          f"fallback rate {load['fallback_rate']:.1%}", file=sys.stderr)
+    print(f"memory: {memory['peak_kb']['p50']:.0f} KB peak heap per request (p50), "
+          f"RSS growth {memory['rss_growth_kb']} KB", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Benchmark: targeted lxml iframe/script pass vs the full BeautifulSoup parse.
+
+Run from the repository root, optionally with saved player pages:
+
+    python benchmarks/bench_parse.py [--repeat N] [page.html ...]
+
+Without page arguments a synthetic corpus is generated. Each parser runs in
+its own subprocess so the reported peak memory is not polluted by the other.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Offline: never probe the real mirrors
+os.environ.setdefault('MIRROR_MONITOR', '0')
+
+MODES = ['html.parser', 'lxml']
+
+
+def load_pages(paths, seed):
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+
+    from bench_extraction import make_page
+    rng = random.Random(seed)
+    return [(f"synthetic-{size}", make_page(rng, size)) for size in (50, 500, 5000)]
+
+
+def run_child(mode, repeat, paths, seed):
+    """Parse every page with one mode and print timings as JSON"""
+    os.environ['HTML_PARSER'] = mode
+    import app
+
+    pages = load_pages(paths, seed)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results = {}
+    for name, page in pages:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            elements = app.scraper.parse_page_elements(page)
+        elapsed = (time.perf_counter() - started) / repeat
+        results[name] = {
+            'bytes': len(page),
+            'parse_ms': elapsed * 1000,
+            'iframes': len(elements[0]),
+            'scripts': len(elements[1]),
+            'digest': hash(repr(elements)),
+        }
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'pages': results, 'peak_delta_kb': peak_kb - baseline_kb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pages', nargs='*', help='saved HTML pages to parse')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.repeat, args.pages, args.seed)
+        return 0
+
+    reports = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', mode, '--repeat', str(args.repeat),
+             '--seed', str(args.seed), *args.pages],
+            capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONHASHSEED='0'),
+        ).stdout
+        reports[mode] = json.loads(output.strip().splitlines()[-1])
+
+    bs, lx = reports['html.parser'], reports['lxml']
+    print(f"{'page':<24} {'bytes':>10} {'bs4 ms':>10} {'lxml ms':>10} {'speedup':>8} {'same':>5}")
+    for name, bs_page in bs['pages'].items():
+        lx_page = lx['pages'][name]
+        print(f"{name:<24} {bs_page['bytes']:>10} {bs_page['parse_ms']:>10.2f} {lx_page['parse_ms']:>10.2f} "
+              f"{bs_page['parse_ms'] / lx_page['parse_ms']:>7.1f}x {str(bs_page['digest'] == lx_page['digest']):>5}")
+    print(f"peak RSS growth: bs4 {bs['peak_delta_kb']} KB, lxml {lx['peak_delta_kb']} KB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
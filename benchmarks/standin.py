@@ -0,0 +1,179 @@
+"""Local HTTP stand-in for the vidfast mirrors that replays the saved corpus.
+
+Run from the repository root to serve it on its own:
+
+    python benchmarks/standin.py [--port 8765] [--latency-ms 40] [--jitter-ms 20]
+                                 [--error-rate 0.02] [--error-status 502]
+
+Request paths are matched against corpus/routes.json; each route names the
+corpus file to serve and any {{name}} placeholders in it are filled from the
+route's named groups, so every title id gets its own iframe and source URLs.
+Unmatched paths (the candidate URL templates the site does not use, dead
+player servers) get a 404. Every response is delayed by the configured
+latency, and a fraction of requests fail with the error status (502 by
+default; 429 or 503 also exercise the scraper's per-host backoff) or a
+dropped connection.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+
+def load_routes(corpus_dir=CORPUS_DIR):
+    """Return [(compiled pattern, body bytes, content type)] from routes.json"""
+    with open(os.path.join(corpus_dir, 'routes.json')) as f:
+        routes = json.load(f)
+    loaded = []
+    for route in routes:
+        with open(os.path.join(corpus_dir, route['file']), 'rb') as f:
+            body = f.read()
+        loaded.append((re.compile(route['pattern']), body, route.get('content_type', 'text/html; charset=utf-8')))
+    return loaded
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (early exit, probe budgets) are expected here
+        pass
+
+
+def render(body, groups):
+    for name, value in groups.items():
+        if value is not None:
+            body = body.replace(b'{{' + name.encode() + b'}}', value.encode())
+    return body
+
+
+class StandIn:
+    """Threaded HTTP server replaying the corpus with injected latency and errors"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=502, seed=None,
+                 host='127.0.0.1', port=0, corpus_dir=CORPUS_DIR):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.routes = load_routes(corpus_dir)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'not_found': 0, 'errors': 0, 'dropped': 0}
+        self.server = QuietServer((host, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='standin', daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def roll(self):
+        """Return (delay seconds, failure) for one request: None, 'error' or 'drop'"""
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failure = None
+            if self.rng.random() < self.error_rate:
+                failure = self.rng.choice(('error', 'drop'))
+        return delay, failure
+
+    def lookup(self, path):
+        for pattern, body, content_type in self.routes:
+            match = pattern.match(path)
+            if match:
+                return render(body, match.groupdict()), content_type
+        return None, None
+
+    def handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                delay, failure = standin.roll()
+                time.sleep(delay)
+                if failure == 'drop':
+                    standin.count('dropped')
+                    self.close_connection = True
+                    return
+                if failure == 'error':
+                    standin.count('errors')
+                    self.respond(standin.error_status, b'Upstream error', 'text/plain')
+                    return
+
+                body, content_type = standin.lookup(self.path.split('?', 1)[0])
+                if body is None:
+                    standin.count('not_found')
+                    self.respond(404, b'Not Found', 'text/plain')
+                    return
+
+                standin.count('ok')
+                if self.headers.get('Range') and content_type.startswith('video/'):
+                    self.respond(206, body[:1], content_type,
+                                 {'Content-Range': f"bytes 0-0/{len(body)}"})
+                    return
+                self.respond(200, body, content_type)
+
+            def respond(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=40)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=502)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    standin = StandIn(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed,
+                      args.host, args.port)
+    print(f"Replaying {len(standin.routes)} corpus routes on {standin.base_url}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.server.server_close()
+        print(json.dumps(standin.stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
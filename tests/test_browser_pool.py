@@ -0,0 +1,127 @@
+"""Headless browser fallback, driven by a fake WebDriver.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Nothing persisted, and the real mirrors are never probed
+for name, value in {'MIRROR_MONITOR': '0', 'TEMPLATE_INDEX_PATH': '', 'CLEARANCE_STORE_PATH': ''}.items():
+    os.environ.setdefault(name, value)
+
+import app  # noqa: E402
+
+
+def log_entry(method, params):
+    return {'message': json.dumps({'message': {'method': method, 'params': params}})}
+
+
+class FakeDriver:
+    """Answers every page with one playlist request; hangs in get() until quit when told to"""
+
+    def __init__(self, hang=False):
+        self.hang = hang
+        self.log = []
+        self.pages = []
+        self.quit_called = threading.Event()
+
+    def get_log(self, kind):
+        entries, self.log = self.log, []
+        return entries
+
+    def set_page_load_timeout(self, timeout):
+        pass
+
+    def get(self, url):
+        if url == 'about:blank':
+            return
+        if self.hang:
+            self.quit_called.wait(30)
+            raise RuntimeError('invalid session id')
+        self.pages.append(url)
+        self.log.append(log_entry('Network.requestWillBeSent', {'request': {'url': url + '/master.m3u8'}}))
+
+    def quit(self):
+        self.quit_called.set()
+
+
+@pytest.fixture(autouse=True)
+def quick_settle(monkeypatch):
+    monkeypatch.setattr(app, 'BROWSER_SETTLE_TIME', 0)
+
+
+def test_media_requests():
+    entries = [
+        log_entry('Network.requestWillBeSent', {'request': {'url': 'https://cdn/a/master.m3u8?token=1'}}),
+        log_entry('Network.requestWillBeSent', {'request': {'url': 'https://cdn/poster.jpg'}}),
+        log_entry('Network.requestWillBeSent', {'request': {'url': 'blob:https://cdn/movie.mp4'}}),
+        log_entry('Network.responseReceived', {'response': {'url': 'https://cdn/manifest', 'mimeType': 'application/dash+xml'}}),
+        log_entry('Network.responseReceived', {'response': {'url': 'https://cdn/seg', 'mimeType': 'application/VND.APPLE.MPEGURL'}}),
+        log_entry('Network.responseReceived', {'response': {'url': 'https://cdn/app.js', 'mimeType': 'text/javascript'}}),
+        log_entry('Network.loadingFinished', {'requestId': '1'}),
+        {'message': 'not json'},
+        {},
+    ]
+
+    assert app.media_requests(entries) == [
+        'https://cdn/a/master.m3u8?token=1', 'https://cdn/manifest', 'https://cdn/seg'
+    ]
+
+
+def test_pool_reuses_then_relaunches_after_max_pages():
+    drivers = []
+
+    def factory():
+        drivers.append(FakeDriver())
+        return drivers[-1]
+
+    pool = app.BrowserPool(factory=factory, size=1, max_pages=2)
+    try:
+        for n in range(3):
+            assert pool.capture(f"http://player/{n}", 5) == [f"http://player/{n}/master.m3u8"]
+    finally:
+        pool.close()
+
+    assert [driver.pages for driver in drivers] == [['http://player/0', 'http://player/1'], ['http://player/2']]
+    assert drivers[0].quit_called.is_set()
+    info = pool.info()
+    assert (info['launches'], info['recycled'], info['pages'], info['media_found']) == (2, 1, 3, 3)
+    assert info['created'] == 0 and info['idle'] == 0
+
+
+def test_watchdog_kills_a_stuck_browser(monkeypatch):
+    monkeypatch.setattr(app, 'BROWSER_KILL_GRACE', 0.2)
+    driver = FakeDriver(hang=True)
+    pool = app.BrowserPool(factory=lambda: driver, size=1)
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError):
+        pool.capture('http://player/stuck', app.MIN_FETCH_TIMEOUT)
+
+    assert time.monotonic() - started < app.MIN_FETCH_TIMEOUT + 2
+    assert driver.quit_called.is_set()
+    info = pool.info()
+    assert (info['killed'], info['page_errors'], info['pages']) == (1, 1, 0)
+    assert info['created'] == 0
+    pool.close()
+
+
+def test_browser_sources_skipped_once_deadline_expired(monkeypatch):
+    def factory():
+        raise AssertionError('no browser should be launched')
+
+    pool = app.BrowserPool(factory=factory, size=1)
+    monkeypatch.setattr(app.scraper, 'browsers', pool)
+
+    assert app.scraper.browser_sources('http://player/late', app.Deadline(0)) == []
+    assert pool.info()['launches'] == 0 and pool.info()['launch_errors'] == 0
@@ -0,0 +1,89 @@
+"""HLS master playlist parsing and the quality ranking it feeds.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Nothing persisted, and the real mirrors are never probed
+for name, value in {'MIRROR_MONITOR': '0', 'TEMPLATE_INDEX_PATH': '', 'CLEARANCE_STORE_PATH': ''}.items():
+    os.environ.setdefault(name, value)
+
+import app  # noqa: E402
+
+MASTER = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+360/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000,AVERAGE-BANDWIDTH=4500000,RESOLUTION=1920x1080,CODECS="hvc1.1.6.L120,mp4a.40.2"
+1080/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=64000,CODECS="mp4a.40.2"
+audio/index.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXTINF:6.0,
+segment0.ts
+#EXT-X-ENDLIST
+"""
+
+
+@pytest.fixture
+def manifests(monkeypatch):
+    manifests = app.ManifestCache()
+    monkeypatch.setattr(app.scraper, 'manifests', manifests)
+    return manifests
+
+
+def test_parse_master_playlist():
+    variants = app.parse_master_playlist(MASTER)
+
+    assert variants == [
+        {'width': 640, 'height': 360, 'bandwidth': 800000, 'codecs': 'avc1.4d401e,mp4a.40.2'},
+        {'width': 1920, 'height': 1080, 'bandwidth': 4500000, 'codecs': 'hvc1.1.6.L120,mp4a.40.2'},
+        {'width': 0, 'height': 0, 'bandwidth': 64000, 'codecs': 'mp4a.40.2'},
+    ]
+    assert app.best_variant(variants)['height'] == 1080
+
+
+def test_parse_media_playlist_has_no_variants():
+    assert app.parse_master_playlist(MEDIA) == []
+    assert app.best_variant([]) is None
+
+
+def test_failures_are_cached_apart_from_media_playlists(manifests):
+    manifests.set('http://a/media.m3u8', app.parse_master_playlist(MEDIA))
+    manifests.set('http://a/failed.m3u8', None)
+
+    assert manifests.get('http://a/media.m3u8') == ()
+    assert manifests.get('http://a/failed.m3u8') is app.PLAYLIST_FAILED
+    assert manifests.pending(['http://a/media.m3u8', 'http://a/failed.m3u8', 'http://a/new.m3u8']) == [
+        'http://a/new.m3u8'
+    ]
+    assert manifests.info()['failures'] == 1
+
+
+def test_inspected_playlists_rank_above_guesses_and_failures_last(manifests):
+    low = [variant for variant in app.parse_master_playlist(MASTER) if variant['height'] == 360]
+    manifests.set('http://a/master.m3u8', app.parse_master_playlist(MASTER))
+    manifests.set('http://a/low.m3u8', low)
+    manifests.set('http://a/media.m3u8', [])
+    manifests.set('http://a/failed.m3u8', None)
+
+    ranked = app.scraper.sort_sources_by_quality([
+        'http://a/failed.m3u8', 'http://a/movie_1080p.mp4', 'http://a/uninspected.m3u8',
+        'http://a/media.m3u8', 'http://a/low.m3u8', 'http://a/master.m3u8',
+    ])
+
+    assert ranked[:2] == ['http://a/master.m3u8', 'http://a/low.m3u8']
+    assert set(ranked[2:4]) == {'http://a/uninspected.m3u8', 'http://a/media.m3u8'}
+    assert ranked[4:] == ['http://a/movie_1080p.mp4', 'http://a/failed.m3u8']
+    assert app.scraper.get_quality_label('http://a/master.m3u8') == '1080p HLS · HEVC · 4.5 Mbps'
@@ -0,0 +1,69 @@
+"""Concurrent iframe crawling: early stop, grace period and deadline.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Nothing persisted, and the real mirrors are never probed
+for name, value in {'MIRROR_MONITOR': '0', 'TEMPLATE_INDEX_PATH': '', 'CLEARANCE_STORE_PATH': ''}.items():
+    os.environ.setdefault(name, value)
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def iframes(monkeypatch):
+    """Fake iframe scrapes: 'http://player/<seconds>' sleeps that long and yields one 1080p source"""
+    monkeypatch.setattr(app, 'IFRAME_CONCURRENCY', 4)
+
+    def scrape_iframe_sources(iframe_url, deadline, crawl, depth):
+        time.sleep(float(iframe_url.rsplit('/', 1)[1]))
+        sources = [iframe_url + '/movie_1080p.mp4']
+        crawl.record(sources, app.scraper.get_quality_score)
+        return sources
+
+    monkeypatch.setattr(app.scraper, 'scrape_iframe_sources', scrape_iframe_sources)
+
+
+def test_enough_sources_collects_finished_iframes_within_grace(iframes):
+    crawl = app.IframeCrawl(enough_sources=1, stop_grace=0.3)
+    urls = ['http://player/0.05', 'http://player/0.1', 'http://player/3']
+
+    started = time.monotonic()
+    sources = app.scraper.crawl_iframes(urls, app.Deadline(10), crawl, 1)
+
+    assert time.monotonic() - started < 1
+    assert sorted(sources) == ['http://player/0.05/movie_1080p.mp4', 'http://player/0.1/movie_1080p.mp4']
+
+
+def test_deadline_abandons_running_iframes(iframes):
+    crawl = app.IframeCrawl(enough_sources=10)
+    urls = ['http://player/0.05', 'http://player/3', 'http://player/3']
+
+    started = time.monotonic()
+    sources = app.scraper.crawl_iframes(urls, app.Deadline(0.3), crawl, 1)
+
+    assert time.monotonic() - started < 1
+    assert sources == ['http://player/0.05/movie_1080p.mp4']
+
+
+def test_wait_timeout():
+    deadline = app.Deadline(10)
+    crawl = app.IframeCrawl(enough_sources=1, stop_grace=0.2)
+    assert 9 < crawl.wait_timeout(deadline) <= 10
+    assert crawl.wait_timeout(None) is None
+
+    crawl.record(['http://a/movie_1080p.mp4'], app.scraper.get_quality_score)
+    assert 0 < crawl.wait_timeout(deadline) <= 0.2
+    time.sleep(0.25)
+    assert crawl.wait_timeout(deadline) == 0
+    assert crawl.wait_timeout(None) == 0
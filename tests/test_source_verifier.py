@@ -0,0 +1,128 @@
+"""Source liveness verification against local stand-in servers.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+# Nothing persisted, and the real mirrors are never probed
+for name, value in {'MIRROR_MONITOR': '0', 'TEMPLATE_INDEX_PATH': '', 'CLEARANCE_STORE_PATH': ''}.items():
+    os.environ.setdefault(name, value)
+
+import app  # noqa: E402
+from standin import StandIn  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def fast():
+    standin = StandIn(latency_ms=10)
+    base_url = standin.start()
+    yield base_url
+    standin.stop()
+
+
+@pytest.fixture(scope='module')
+def slow():
+    standin = StandIn(latency_ms=3000)
+    base_url = standin.start()
+    yield base_url
+    standin.stop()
+
+
+@pytest.fixture
+def refused():
+    """A URL on a port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/media/refused.mp4"
+
+
+@pytest.fixture
+def verifier(monkeypatch):
+    verifier = app.SourceVerifier()
+    monkeypatch.setattr(app.scraper, 'verifier', verifier)
+    return verifier
+
+
+@pytest.mark.parametrize('status, alive', [
+    (200, True), (206, True), (301, True), (403, None), (429, None), (404, False), (410, False), (502, False),
+])
+def test_classify(status, alive):
+    assert app.SourceVerifier.classify(status) is alive
+
+
+def test_rank_drops_dead_and_charges_latency():
+    verifier = app.SourceVerifier()
+    verifier.set('http://a/slow.mp4', True, 0.5)
+    verifier.set('http://a/fast.mp4', True, 0.05)
+    verifier.set('http://a/dead.mp4', False, None)
+    verifier.set('http://a/unconfirmed.mp4', None, None)
+
+    ranked = verifier.rank(
+        ['http://a/unconfirmed.mp4', 'http://a/dead.mp4', 'http://a/slow.mp4', 'http://a/fast.mp4'],
+        lambda url: 10
+    )
+
+    assert ranked == ['http://a/fast.mp4', 'http://a/slow.mp4', 'http://a/unconfirmed.mp4']
+    assert verifier.info()['dropped'] == 1
+
+
+def test_dead_and_unconfirmed_results_expire_first():
+    verifier = app.SourceVerifier(ttl=60, dead_ttl=0.2)
+    verifier.set('http://a/live.mp4', True, 0.1)
+    verifier.set('http://a/dead.mp4', False, None)
+    verifier.set('http://a/unconfirmed.mp4', None, None)
+    assert verifier.pending(['http://a/live.mp4', 'http://a/dead.mp4', 'http://a/unconfirmed.mp4']) == []
+
+    time.sleep(0.3)
+
+    assert verifier.get('http://a/live.mp4') == (True, 0.1)
+    assert verifier.pending(['http://a/live.mp4', 'http://a/dead.mp4', 'http://a/unconfirmed.mp4']) == [
+        'http://a/dead.mp4', 'http://a/unconfirmed.mp4'
+    ]
+
+
+def test_verify_sources_probes_within_budget(verifier, fast, slow, refused):
+    live = f"{fast}/media/live.mp4"
+    missing = f"{fast}/media/missing.m3u8"
+    sluggish = f"{slow}/media/sluggish.mp4"
+
+    started = time.monotonic()
+    ranked = app.scraper.verify_sources([sluggish, missing, refused, live], app.Deadline(1))
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 1.5
+    assert ranked == [live, sluggish]
+    alive, ttfb = verifier.get(live)
+    assert alive is True and 0 < ttfb < 1
+    assert verifier.get(missing)[0] is False
+    assert verifier.get(refused)[0] is False
+    assert verifier.get(sluggish) == (None, None)
+
+
+def test_verify_sources_reuses_fresh_results(verifier, fast):
+    live = f"{fast}/media/cached.mp4"
+    app.scraper.verify_sources([live], app.Deadline(1))
+    probes = verifier.info()['probes']
+
+    assert app.scraper.verify_sources([live], app.Deadline(1)) == [live]
+    assert verifier.info()['probes'] == probes
+    assert verifier.info()['hits'] == 1
+
+
+def test_verify_sources_skips_probes_once_deadline_expired(verifier, fast):
+    live = f"{fast}/media/late.mp4"
+
+    assert app.scraper.verify_sources([live], app.Deadline(0)) == [live]
+    assert verifier.info()['probes'] == 0